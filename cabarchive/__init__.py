@@ -7,3 +7,4 @@
 
 from . cabarchive import CabArchive, NotSupportedError
 from . cabfile import CabFile
+from . cabreader import CabReader
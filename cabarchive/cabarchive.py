@@ -9,18 +9,15 @@
 
 import os
 
-import gi
-
-gi.require_version('GCab', '1.0')
-
-from gi.repository import GCab
-from gi.repository import Gio
-from gi.repository import GLib
-
 from . cabfile import CabFile
+from . errors import NotSupportedError
 
-class NotSupportedError(NotImplementedError):
-    pass
+def _import_gcab():
+    """ Imports GCab when first used, so that CabReader does not need PyGObject """
+    import gi
+    gi.require_version('GCab', '1.0')
+    from gi.repository import GCab, Gio, GLib
+    return GCab, Gio, GLib
 
 class CabArchive(dict):
     """An object representing a Microsoft Cab archive """
@@ -31,11 +28,12 @@ class CabArchive(dict):
 
         # load archive
         if buf:
+            GCab, Gio, GLib = _import_gcab()
             istream = Gio.MemoryInputStream.new_from_bytes(GLib.Bytes.new(buf))
             cfarchive = GCab.Cabinet.new()
             try:
                 cfarchive.load(istream)
-            except gi.repository.GLib.GError as e:
+            except GLib.GError as e:
                 raise NotSupportedError(e)
             cfarchive.extract(None)
             for cffolder in cfarchive.get_folders():
@@ -54,6 +52,7 @@ class CabArchive(dict):
 
     def save(self, compress=False):
         """ Output a MS Cabinet archive to bytes """
+        GCab, Gio, GLib = _import_gcab()
         cfarchive = GCab.Cabinet.new()
 
         # add a default folder with no compress
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+
+import os
+import struct
+import zlib
+
+from collections.abc import Mapping
+
+from . cabfile import CabFile
+from . errors import NotSupportedError
+
+# CFHEADER.flags
+_FLAG_PREV_CABINET = 0x0001
+_FLAG_NEXT_CABINET = 0x0002
+_FLAG_RESERVE_PRESENT = 0x0004
+
+# CFFOLDER.typeCompress
+_COMPRESSION_NONE = 0x0
+_COMPRESSION_MSZIP = 0x1
+
+# CFFILE.attribs
+_ATTRIB_NAME_IS_UTF = 0x80
+
+# MSZIP blocks use the previous 32kB of the folder as the dictionary
+_MSZIP_HISTORY_SIZE = 0x8000
+
+class _CabMember:
+
+    """ A CFFILE entry, which is only decompressed when first accessed """
+
+    def __init__(self, filename, size, offset, ifolder):
+        self.filename = filename
+        self.size = size
+        self.offset = offset        # in the uncompressed folder
+        self.ifolder = ifolder
+
+class _CabFolder:
+
+    """ A CFFOLDER entry, decompressed one CFDATA block at a time """
+
+    def __init__(self, offset, block_cnt, compression):
+        self.offset = offset        # of the next CFDATA block in the archive
+        self.block_cnt = block_cnt  # CFDATA blocks not yet decompressed
+        self.compression = compression
+        self.buf = bytearray()
+
+class CabReader(Mapping):
+
+    """
+    Reads a MS Cabinet archive without using GCab.
+
+    The archive can be bytes, a mmap or a seekable file object. Only the headers
+    are parsed when the reader is created, and each folder is decompressed
+    when a member in it is first accessed, and then only as far as needed.
+    """
+
+    def __init__(self, src, flattern=True):
+        if hasattr(src, 'read'):
+            self._f = src
+            self._buf = None
+        else:
+            self._f = None
+            self._buf = memoryview(src)
+        self._folders = []
+        self._members = {}
+        self._data_reserved_size = 0
+        try:
+            self._parse(flattern)
+        except struct.error as e:
+            raise NotSupportedError('Archive is truncated: %s' % str(e))
+
+    def _read_upto(self, offset, size):
+        if self._f:
+            self._f.seek(offset)
+            return self._f.read(size)
+        return bytes(self._buf[offset:offset + size])
+
+    def _read(self, offset, size):
+        buf = self._read_upto(offset, size)
+        if len(buf) != size:
+            raise NotSupportedError('Archive is truncated at 0x%x' % offset)
+        return buf
+
+    def _read_string(self, offset):
+        """ Reads a NUL-terminated string, returning it and the size read """
+        buf = b''
+        while True:
+            chunk = self._read_upto(offset + len(buf), 0x100)
+            if not chunk:
+                raise NotSupportedError('Archive is truncated at 0x%x' % offset)
+            idx = chunk.find(b'\0')
+            if idx != -1:
+                buf += chunk[:idx]
+                return buf, len(buf) + 1
+            buf += chunk
+
+    def _parse(self, flattern):
+
+        # CFHEADER
+        (signature, _, _, _, offset_files, _, _, _,
+         folder_cnt, file_cnt, flags, _, _) = struct.unpack('<4sIIIIIBBHHHHH', self._read(0, 36))
+        if signature != b'MSCF':
+            raise NotSupportedError('Data is not a MS Cabinet archive')
+        if flags & (_FLAG_PREV_CABINET | _FLAG_NEXT_CABINET):
+            raise NotSupportedError('Multi-cabinet archives are not supported')
+        offset = 36
+        folder_reserved_size = 0
+        if flags & _FLAG_RESERVE_PRESENT:
+            header_reserved_size, folder_reserved_size, self._data_reserved_size = \
+                struct.unpack('<HBB', self._read(offset, 4))
+            offset += 4 + header_reserved_size
+
+        # CFFOLDER
+        for _ in range(folder_cnt):
+            offset_data, block_cnt, compression = struct.unpack('<IHH', self._read(offset, 8))
+            self._folders.append(_CabFolder(offset_data, block_cnt, compression & 0x000f))
+            offset += 8 + folder_reserved_size
+
+        # CFFILE
+        offset = offset_files
+        for _ in range(file_cnt):
+            size, offset_folder, ifolder, _, _, attribs = \
+                struct.unpack('<IIHHHH', self._read(offset, 16))
+            name, name_size = self._read_string(offset + 16)
+            offset += 16 + name_size
+            if attribs & _ATTRIB_NAME_IS_UTF:
+                fn = name.decode('utf-8')
+            else:
+                fn = name.decode('latin-1')
+
+            # replace win32-style backslashes
+            fn = fn.replace('\\', '/')
+            if flattern:
+                fn = os.path.basename(fn)
+            if ifolder >= len(self._folders):
+                raise NotSupportedError('File %s is in an invalid folder' % fn)
+            self._members[fn] = _CabMember(fn, size, offset_folder, ifolder)
+
+    def _decompress_block(self, folder):
+
+        # CFDATA
+        _, size, size_uncompressed = struct.unpack('<IHH', self._read(folder.offset, 8))
+        folder.offset += 8 + self._data_reserved_size
+        buf = self._read(folder.offset, size)
+        folder.offset += size
+        folder.block_cnt -= 1
+
+        if folder.compression == _COMPRESSION_NONE:
+            folder.buf += buf
+            return
+        if folder.compression == _COMPRESSION_MSZIP:
+            if buf[:2] != b'CK':
+                raise NotSupportedError('Invalid MSZIP block signature')
+            history = bytes(folder.buf[-_MSZIP_HISTORY_SIZE:])
+            try:
+                if history:
+                    decompressobj = zlib.decompressobj(-zlib.MAX_WBITS, zdict=history)
+                else:
+                    decompressobj = zlib.decompressobj(-zlib.MAX_WBITS)
+                buf = decompressobj.decompress(buf[2:])
+            except zlib.error as e:
+                raise NotSupportedError('Invalid MSZIP block: %s' % str(e))
+            if len(buf) != size_uncompressed:
+                raise NotSupportedError('MSZIP block was 0x%x bytes, expected 0x%x' % \
+                                        (len(buf), size_uncompressed))
+            folder.buf += buf
+            return
+        raise NotSupportedError('Compression type 0x%x is not supported' % folder.compression)
+
+    def _get_member_data(self, member):
+        folder = self._folders[member.ifolder]
+        end = member.offset + member.size
+        while len(folder.buf) < end:
+            if not folder.block_cnt:
+                raise NotSupportedError('File %s is truncated' % member.filename)
+            self._decompress_block(folder)
+        return bytes(folder.buf[member.offset:end])
+
+    def get_size(self, filename):
+        """ Returns the uncompressed size of a member without decompressing it """
+        return self._members[filename].size
+
+    def __getitem__(self, filename):
+        member = self._members[filename]
+        return CabFile(self._get_member_data(member), filename=filename)
+
+    def __contains__(self, filename):
+        return filename in self._members
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def __len__(self):
+        return len(self._members)
+
+    def __repr__(self):
+        return 'CabReader({})'.format(list(self._members))
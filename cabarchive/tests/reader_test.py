@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import unittest
+import hashlib
+import io
+import struct
+import zlib
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+
+from cabarchive import CabArchive, CabFile, CabReader, NotSupportedError
+
+def _build_cab(files, compression=0, block_size=0x8000):
+    """ Builds a single-folder archive, splitting the data into CFDATA blocks """
+
+    data = b''.join([files[fn] for fn in files])
+    blocks = []
+    for offset in range(0, len(data), block_size):
+        buf = data[offset:offset + block_size]
+        if compression == 1:
+            history = data[max(0, offset - 0x8000):offset]
+            if history:
+                compressobj = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=history)
+            else:
+                compressobj = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+            blocks.append((b'CK' + compressobj.compress(buf) + compressobj.flush(), len(buf)))
+        else:
+            blocks.append((buf, len(buf)))
+
+    # CFFILE
+    cffiles = b''
+    offset = 0
+    for fn in files:
+        cffiles += struct.pack('<IIHHHH', len(files[fn]), offset, 0, 0, 0, 0) + fn.encode() + b'\0'
+        offset += len(files[fn])
+
+    # CFDATA
+    offset_data = 36 + 8 + len(cffiles)
+    cfdata = b''
+    for buf, size in blocks:
+        cfdata += struct.pack('<IHH', 0, len(buf), size) + buf
+
+    size = offset_data + len(cfdata)
+    header = struct.pack('<4sIIIIIBBHHHHH', b'MSCF', 0, size, 0, 36 + 8, 0, 3, 1,
+                         1, len(files), 0, 0, 0)
+    cffolder = struct.pack('<IHH', offset_data, len(blocks), compression)
+    return header + cffolder + cffiles + cfdata
+
+class TestCabReader(unittest.TestCase):
+
+    def test_checksums(self):
+        with open('contrib/hughski-colorhug2-2.0.3.cab', 'rb') as f:
+            cabreader = CabReader(f.read())
+        results = {
+            'firmware.bin' : 'c57c7de8f7029acc44a4bfad6efd6ab0a7092cc6',
+            'firmware.inf' : 'b0cb43bfb2f55fd15a8814c5c5c7b9f2ce2f4572',
+            'firmware.metainfo.xml' : 'a8fda77f8baa56917ee1201b72747612c49e855b',
+        }
+        self.assertEqual(sorted(cabreader), sorted(results))
+        for fn in results:
+            self.assertEqual(hashlib.sha1(cabreader[fn].buf).hexdigest(), results[fn])
+
+    def test_file(self):
+        with open('contrib/hughski-colorhug2-2.0.3.cab', 'rb') as f:
+            cabreader = CabReader(f)
+            self.assertEqual(cabreader.get_size('firmware.inf'), 489)
+            self.assertEqual(hashlib.sha1(cabreader['firmware.inf'].buf).hexdigest(),
+                             'b0cb43bfb2f55fd15a8814c5c5c7b9f2ce2f4572')
+
+    def test_missing(self):
+        with open('contrib/hughski-colorhug2-2.0.3.cab', 'rb') as f:
+            cabreader = CabReader(f.read())
+        self.assertNotIn('README.txt', cabreader)
+        with self.assertRaises(KeyError):
+            self.assertIsNone(cabreader['README.txt'])
+
+    def test_invalid(self):
+        with self.assertRaises(NotSupportedError):
+            with open('contrib/pylint.sh', 'rb') as f:
+                _ = CabReader(f.read())
+        with open('contrib/hughski-colorhug2-2.0.3.cab', 'rb') as f:
+            buf = f.read()
+        with self.assertRaises(NotSupportedError):
+            _ = CabReader(buf[:40])
+
+    def test_gcab_compressed(self):
+        cabarchive = CabArchive()
+        cabarchive['README.txt'] = CabFile(b'foofoofoofoofoofoofoofoo')
+        cabarchive['firmware.bin'] = CabFile(b'barbarbarbarbarbarbarbar')
+        cabreader = CabReader(cabarchive.save(compress=True))
+        self.assertEqual(cabreader['README.txt'].buf, b'foofoofoofoofoofoofoofoo')
+        self.assertEqual(cabreader['firmware.bin'].buf, b'barbarbarbarbarbarbarbar')
+
+    def test_mszip_blocks(self):
+
+        # the later blocks refer back to the data in the earlier ones
+        files = {
+            'firmware.metainfo.xml': b'<component/>',
+            'firmware.bin': b''.join([struct.pack('<I', idx % 0x3000) for idx in range(0x10000)]),
+        }
+        buf = _build_cab(files, compression=1)
+        self.assertLess(len(buf), len(files['firmware.bin']))
+        cabreader = CabReader(io.BytesIO(buf))
+        for fn in files:
+            self.assertEqual(cabreader[fn].buf, files[fn])
+
+    def test_lazy(self):
+
+        # the listing works even if the data cannot be decompressed
+        buf = bytearray(_build_cab({'firmware.bin': b'foo'}))
+        struct.pack_into('<H', buf, 36 + 6, 0x3)
+        cabreader = CabReader(bytes(buf))
+        self.assertEqual(list(cabreader), ['firmware.bin'])
+        self.assertEqual(cabreader.get_size('firmware.bin'), 3)
+        with self.assertRaises(NotSupportedError):
+            _ = cabreader['firmware.bin']
+
+if __name__ == '__main__':
+    unittest.main()
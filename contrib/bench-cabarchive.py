@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import time
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+
+from cabarchive import CabArchive, CabFile, CabReader
+
+def _bench(name, fn, cnt):
+    start = time.perf_counter()
+    for _ in range(cnt):
+        fn()
+    print('%-24s %8.2f ms' % (name, (time.perf_counter() - start) * 1000 / cnt))
+
+def _bench_archive(buf, cnt):
+    _bench('gcab listing', lambda: list(CabArchive(buf)), cnt)
+    _bench('reader listing', lambda: list(CabReader(buf)), cnt)
+    _bench('gcab metainfo', lambda: CabArchive(buf)['firmware.metainfo.xml'].buf, cnt)
+    _bench('reader metainfo', lambda: CabReader(buf)['firmware.metainfo.xml'].buf, cnt)
+    _bench('gcab payload', lambda: CabArchive(buf)['firmware.bin'].buf, cnt)
+    _bench('reader payload', lambda: CabReader(buf)['firmware.bin'].buf, cnt)
+
+def main():
+
+    # size of the firmware payload in MB
+    size = 8
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    cnt = 10
+
+    # semi-compressible, like most firmware images
+    blob = os.urandom(0x100) * (size * 0x1000)
+    metainfo = b'<component type="firmware"/>'
+
+    # members are only decompressed as far as needed, so the order matters
+    for layout in ['metainfo-first', 'payload-first']:
+        cabarchive = CabArchive()
+        if layout == 'metainfo-first':
+            cabarchive['firmware.metainfo.xml'] = CabFile(metainfo)
+        cabarchive['firmware.bin'] = CabFile(blob)
+        if layout == 'payload-first':
+            cabarchive['firmware.metainfo.xml'] = CabFile(metainfo)
+        buf = cabarchive.save(compress=True)
+        print('%s archive of %i bytes with a %i byte payload' % (layout, len(buf), len(blob)))
+        _bench_archive(buf, cnt)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import gzip
+import io
+import lzma
+import time
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+
+from lvfs.metadata import _get_metadata_compressor, zstandard
+
+def _decompress(blob, suffix):
+    if suffix == 'gz':
+        return gzip.decompress(blob)
+    if suffix == 'xz':
+        return lzma.decompress(blob)
+    return zstandard.ZstdDecompressor().decompressobj().decompress(blob)
+
+def _bench_codec(xml, suffix, level):
+
+    start = time.perf_counter()
+    with io.BytesIO() as f:
+        compressor = _get_metadata_compressor(f, suffix, level)
+        compressor.write(xml)
+        if suffix == 'zst':
+            compressor.flush(zstandard.FLUSH_FRAME)
+        else:
+            compressor.close()
+        blob = f.getvalue()
+    duration_compress = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if _decompress(blob, suffix) != xml:
+        print('%s level %i did not round trip' % (suffix, level))
+    duration_decompress = time.perf_counter() - start
+    return len(blob), duration_compress, duration_decompress
+
+def main():
+
+    if len(sys.argv) < 2:
+        print('Usage: %s firmware.xml.gz' % sys.argv[0])
+        return 1
+    with open(sys.argv[1], 'rb') as f:
+        xml = f.read()
+    if sys.argv[1].endswith('.gz'):
+        xml = gzip.decompress(xml)
+
+    codecs = [('gz', [1, 5, 9]), ('xz', [0, 3, 6, 9])]
+    if zstandard:
+        codecs.append(('zst', [3, 10, 19]))
+    else:
+        print('zstandard not available, skipping zst')
+
+    print('%6s %6s %12s %8s %12s %12s' % ('codec', 'level', 'size', 'ratio',
+                                           'compress', 'decompress'))
+    for suffix, levels in codecs:
+        for level in levels:
+            size, duration_compress, duration_decompress = _bench_codec(xml, suffix, level)
+            print('%6s %6i %10.1fkB %7.1f%% %10.0fms %10.0fms' % (suffix, level,
+                                                                 size / 1024,
+                                                                 size * 100 / len(xml),
+                                                                 duration_compress * 1000,
+                                                                 duration_decompress * 1000))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import tempfile
+
+from collections import OrderedDict
+
+from lxml import etree as ET
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+
+from lvfs.metadata import _write_metadata_fragments, _write_metadata_delta, _get_fragment_checksum
+
+def _create_fragment(idx, version):
+    component = ET.Element('component')
+    component.set('type', 'firmware')
+    ET.SubElement(component, 'id').text = 'com.example.Device%05i.firmware' % idx
+    ET.SubElement(component, 'name').text = 'Device %i' % idx
+    ET.SubElement(component, 'summary').text = 'Firmware for the example device'
+    releases = ET.SubElement(component, 'releases')
+    for i in range(version, max(version - 5, 0), -1):
+        release = ET.SubElement(releases, 'release')
+        release.set('version', '1.0.%i' % i)
+        ET.SubElement(release, 'location').text = 'https://fwupd.org/downloads/%040x-device.cab' % (idx * 100 + i)
+        description = ET.SubElement(release, 'description')
+        ET.SubElement(description, 'p').text = 'This release fixes a number of bugs. ' * 3
+    provides = ET.SubElement(component, 'provides')
+    child = ET.SubElement(provides, 'firmware')
+    child.set('type', 'flashed')
+    child.text = '%08x-0000-0000-0000-000000000000' % idx
+    return ET.tostring(component, encoding='utf-8')
+
+def main():
+
+    # number of components in the remote
+    cnt = 2000
+    if len(sys.argv) > 1:
+        cnt = int(sys.argv[1])
+
+    fragments_old = OrderedDict()
+    for idx in range(cnt):
+        fragments_old['com.example.Device%05i.firmware' % idx] = _create_fragment(idx, 5)
+    index_old = {}
+    for appstream_id in fragments_old:
+        index_old[appstream_id] = _get_fragment_checksum(fragments_old[appstream_id])
+
+    with tempfile.TemporaryDirectory(prefix='lvfs') as tmpdir:
+        fn = os.path.join(tmpdir, 'firmware.xml.gz')
+        checksum_old, _ = _write_metadata_fragments(fn, list(fragments_old.values()))
+        print('full metadata with %i components: %i bytes' % (cnt, os.path.getsize(fn)))
+
+        # new releases for some devices
+        for changes in [1, 10, 100, 1000]:
+            if changes > cnt:
+                break
+            fragments = OrderedDict(fragments_old)
+            for idx in range(changes):
+                fragments['com.example.Device%05i.firmware' % idx] = _create_fragment(idx, 6)
+            checksum, _ = _write_metadata_fragments(fn, list(fragments.values()))
+            fn_delta = os.path.join(tmpdir, 'firmware-delta.xml.gz')
+            _write_metadata_delta(fn_delta, checksum_old, checksum, index_old, fragments)
+            print('%5i changed: full %8i bytes, delta %8i bytes (%.1f%%)' % \
+                  (changes,
+                   os.path.getsize(fn),
+                   os.path.getsize(fn_delta),
+                   100.0 * os.path.getsize(fn_delta) / os.path.getsize(fn)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import datetime
+import gzip
+import hashlib
+import io
+import multiprocessing
+import random
+import resource
+import tempfile
+import time
+import uuid
+
+from contextlib import redirect_stdout
+from sqlalchemy import event
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+
+from lvfs import app, db, ploader
+from lvfs.dbutils import init_db
+from lvfs.metadata import _generate_metadata_kind, _metadata_update_targets
+from lvfs.models import Vendor, User, Remote, Firmware, Component, Requirement, Guid
+from lvfs.models import Checksum, Setting
+
+def _get_names(fn):
+    with gzip.open(fn, 'rb') as f:
+        return [ln for ln in f.read().decode().split('\n') if ln]
+
+def _make_description(device_name):
+    lines = ['This release updates the %s firmware.' % device_name,
+             'It fixes the following problems:']
+    for idx in range(random.randint(1, 6)):
+        lines.append(' * Fix problem %i when the %s is resumed' % (idx, device_name))
+    return '\n'.join(lines)
+
+def _make_component(fw, vendor_name, device_name, idx):
+    md = Component()
+    md.appstream_id = 'com.%s.%s%i.firmware' % (vendor_name.replace(' ', '').lower(),
+                                                device_name.replace(' ', ''), idx)
+    md.name = device_name
+    md.summary = 'Firmware for the %s %s' % (vendor_name, device_name)
+    md.developer_name = vendor_name
+    md.description = 'The %s is a device made by %s.' % (device_name, vendor_name)
+    md.release_description = _make_description(device_name)
+    md.project_license = 'proprietary'
+    md.metadata_license = 'CC0-1.0'
+    md.url_homepage = 'https://www.example.com/'
+    md.version = '1.%i.%i' % (random.randint(0, 9), random.randint(0, 99))
+    md.release_timestamp = 1500000000 + idx
+    md.release_installed_size = random.randint(0x10000, 0x1000000)
+    md.release_download_size = random.randint(0x10000, 0x1000000)
+    md.checksum_contents = hashlib.sha1(md.appstream_id.encode()).hexdigest()
+    md.filename_contents = 'firmware.bin'
+    md.guids = [Guid(value=str(uuid.uuid4())) for _ in range(random.randint(1, 3))]
+    md.requirements.append(Requirement(kind='id',
+                                       value='org.freedesktop.fwupd',
+                                       compare='ge',
+                                       version='1.2.%i' % random.randint(0, 6)))
+    md.requirements.append(Requirement(kind='firmware',
+                                       compare='ge',
+                                       version='1.0.0'))
+    if random.randint(0, 3) == 0:
+        md.requirements.append(Requirement(kind='hardware', value=str(uuid.uuid4())))
+    md.device_checksums.append(Checksum(hashlib.sha1(md.version.encode()).hexdigest()))
+    fw.mds.append(md)
+
+def _populate(vendor_cnt, fw_cnt, md_cnt):
+    """ Adds a synthetic catalog of firmware to the stable remote """
+
+    # the same catalog is generated every time
+    random.seed(vendor_cnt + fw_cnt + md_cnt)
+    vendor_names = _get_names('data/vendors.txt.gz')
+    device_names = _get_names('data/devices.txt.gz')
+
+    with app.app_context():
+        _populate_db(vendor_cnt, fw_cnt, md_cnt, vendor_names, device_names)
+
+def _populate_db(vendor_cnt, fw_cnt, md_cnt, vendor_names, device_names):
+
+    init_db(db)
+    settings = {}
+    for plugin in ploader.get_all():
+        for s in plugin.settings():
+            settings[s.key] = s.default
+    settings['firmware_baseuri'] = 'https://fwupd.org/downloads/'
+    for key in settings:
+        db.session.add(Setting(key, settings[key]))
+    remote = db.session.query(Remote).filter(Remote.name == 'stable').first()
+
+    users = []
+    for idx in range(vendor_cnt):
+        remote_embargo = Remote(name='embargo-vendor%i' % idx)
+        db.session.add(remote_embargo)
+        db.session.flush()
+        vendor = Vendor('vendor%i' % idx)
+        vendor.display_name = vendor_names[idx % len(vendor_names)]
+        vendor.remote_id = remote_embargo.remote_id
+        db.session.add(vendor)
+        db.session.flush()
+        user = User('user%i@example.com' % idx, vendor_id=vendor.vendor_id)
+        db.session.add(user)
+        db.session.flush()
+        users.append(user)
+
+    for idx in range(fw_cnt):
+        user = users[idx % len(users)]
+        fw = Firmware()
+        fw.vendor_id = user.vendor_id
+        fw.user_id = user.user_id
+        fw.remote_id = remote.remote_id
+        fw.addr = '127.0.0.1'
+        fw.timestamp = datetime.datetime.utcnow()
+        fw.signed_timestamp = fw.timestamp
+        fw.checksum_upload = hashlib.sha1(str(idx).encode()).hexdigest()
+        fw.checksum_signed = hashlib.sha1(fw.checksum_upload.encode()).hexdigest()
+        fw.checksum_pulp = hashlib.sha256(fw.checksum_upload.encode()).hexdigest()
+        fw.filename = fw.checksum_upload + '-firmware.cab'
+        fw.is_dirty = True
+        for j in range(md_cnt):
+            _make_component(fw,
+                            user.vendor.display_name,
+                            random.choice(device_names),
+                            idx * md_cnt + j)
+        db.session.add(fw)
+        if idx % 100 == 0:
+            db.session.commit()
+    db.session.commit()
+
+def _bench_generate(fw_cnt, mode):
+    """ Runs in a new process, so the peak RSS is only for this mode """
+
+    statements = []
+    def _before_cursor_execute(unused_conn, unused_cursor, statement, *unused_args):
+        statements.append(statement)
+
+    with app.test_request_context(), redirect_stdout(io.StringIO()):
+        remote = db.session.query(Remote).filter(Remote.name == 'stable').first()
+        remote.checksum_metadata = None
+        if mode == 'kind':
+            fws = db.session.query(Firmware).all()
+            app.config['METADATA_FRAGMENT_DIR'] = None
+        rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        start = time.perf_counter()
+
+        # when cold everything is dirty, so every component is generated; when
+        # warm nothing is dirty and the fragments saved by the cold run are used
+        if mode in ['targets', 'targets-warm']:
+            _metadata_update_targets([remote])
+
+        # the embargo and local metadata are generated from a list of firmware
+        elif mode == 'kind':
+            _generate_metadata_kind(os.path.join(app.config['DOWNLOAD_DIR'], 'kind.xml.gz'),
+                                    fws, firmware_baseuri='https://fwupd.org/downloads/')
+
+        duration = time.perf_counter() - start
+        event.remove(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_start
+        db.session.commit()
+    print('%8i %14s %10.0fms %8i %10.1fMB' % (fw_cnt, mode, duration * 1000,
+                                              len(statements), rss / 1024))
+
+def _run(target, *args):
+    proc = multiprocessing.Process(target=target, args=args)
+    proc.start()
+    proc.join()
+    if proc.exitcode != 0:
+        sys.exit(proc.exitcode)
+
+def main():
+
+    # number of firmware, with a vendor for every 50 and two components each
+    fw_cnts = [100, 1000, 5000]
+    if len(sys.argv) > 1:
+        fw_cnts = [int(arg) for arg in sys.argv[1:]]
+
+    print('%8s %14s %12s %8s %12s' % ('count', 'mode', 'time', 'queries', 'peak RSS'))
+    for fw_cnt in fw_cnts:
+        with tempfile.TemporaryDirectory(prefix='lvfs') as tmpdir:
+            app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmpdir, 'lvfs.db')
+            app.config['DOWNLOAD_DIR'] = tmpdir
+            app.config['METADATA_WORKERS'] = 1
+            app.config['METADATA_COMPRESSION'] = {'gz': 5}
+            app.config['METADATA_FRAGMENT_DIR'] = os.path.join(tmpdir, 'fragments')
+            for key in ['METADATA_DELTA_DIR', 'METADATA_GUID_DIR']:
+                app.config[key] = None
+            _run(_populate, max(1, fw_cnt // 50), fw_cnt, 2)
+            for mode in ['targets', 'targets-warm', 'kind']:
+                _run(_bench_generate, fw_cnt, mode)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import multiprocessing
+import resource
+import tempfile
+
+from lxml import etree as ET
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+
+from lvfs.metadata import _write_metadata_fragments
+
+def _create_fragment(idx):
+    component = ET.Element('component')
+    component.set('type', 'firmware')
+    ET.SubElement(component, 'id').text = 'com.example.Device%05i.firmware' % idx
+    ET.SubElement(component, 'name').text = 'Device %i' % idx
+    ET.SubElement(component, 'summary').text = 'Firmware for the example device'
+    description = ET.SubElement(component, 'description')
+    ET.SubElement(description, 'p').text = 'This updates the firmware on the device. ' * 5
+    releases = ET.SubElement(component, 'releases')
+    for version in range(5):
+        release = ET.SubElement(releases, 'release')
+        release.set('version', '1.0.%i' % version)
+        release.set('timestamp', str(1500000000 + version))
+        ET.SubElement(release, 'location').text = 'https://fwupd.org/downloads/%040x-device.cab' % idx
+        csum = ET.SubElement(release, 'checksum')
+        csum.set('type', 'sha1')
+        csum.set('target', 'container')
+        csum.text = '%040x' % (idx * 5 + version)
+        description = ET.SubElement(release, 'description')
+        ET.SubElement(description, 'p').text = 'This release fixes a number of bugs. ' * 3
+    provides = ET.SubElement(component, 'provides')
+    child = ET.SubElement(provides, 'firmware')
+    child.set('type', 'flashed')
+    child.text = '%08x-0000-0000-0000-000000000000' % idx
+    return ET.tostring(component, encoding='utf-8')
+
+def _bench_mode(filename, cnt, streaming, queue):
+
+    # the fragments are already in memory when generating the real metadata
+    fragments = [_create_fragment(idx) for idx in range(cnt)]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    _, duration = _write_metadata_fragments(filename, fragments, streaming=streaming)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((rss_after - rss_before, duration))
+
+def main():
+
+    # number of components
+    cnts = [1000, 5000, 20000]
+    if len(sys.argv) > 1:
+        cnts = [int(arg) for arg in sys.argv[1:]]
+
+    # use a new process for each run as the peak RSS is never reset
+    print('%8s %8s %12s %10s' % ('count', 'mode', 'peak RSS', 'time'))
+    with tempfile.TemporaryDirectory(prefix='lvfs') as tmpdir:
+        filename = os.path.join(tmpdir, 'firmware.xml.gz')
+        for cnt in cnts:
+            for streaming in [False, True]:
+                queue = multiprocessing.Queue()
+                proc = multiprocessing.Process(target=_bench_mode,
+                                               args=(filename, cnt, streaming, queue))
+                proc.start()
+                rss, duration = queue.get()
+                proc.join()
+                print('%8i %8s %10.1fMB %8.0fms' % (cnt,
+                                                    'stream' if streaming else 'tree',
+                                                    rss / 1024,
+                                                    duration * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import tempfile
+import time
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+
+from lvfs import app
+
+def _bench_mode(client, mode, uri, iterations):
+
+    # the test client consumes the whole response body, just like the WSGI
+    # server would when sending it to the client, so the time taken is how
+    # long one worker is busy for each download
+    app.config['SENDFILE_MODE'] = mode
+    nbytes = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        rv = client.get(uri)
+        if rv.status_code != 200:
+            print('failed to get %s: %i' % (uri, rv.status_code))
+            sys.exit(1)
+        nbytes += len(rv.data)
+    return (time.perf_counter() - start) / iterations, nbytes / iterations
+
+def main():
+
+    # size of the fake capsule in MB
+    size = 32
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    iterations = 20
+    if len(sys.argv) > 2:
+        iterations = int(sys.argv[2])
+
+    with tempfile.TemporaryDirectory(prefix='lvfs') as tmpdir:
+        with open(os.path.join(tmpdir, 'bench.bin'), 'wb') as f:
+            f.write(os.urandom(size * 1024 * 1024))
+        app.config['UPLOAD_DIR'] = tmpdir
+        client = app.test_client()
+        print('Sending a %iMB file %i times' % (size, iterations))
+        for mode in [None, 'nginx', 'apache']:
+            occupancy, nbytes = _bench_mode(client, mode, '/uploads/bench.bin', iterations)
+            print('%-8s %9.2fms worker time per download, %10i bytes sent by Python' % \
+                  (mode if mode else 'flask', occupancy * 1000, nbytes))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import importlib
+import time
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+sys.path.append(os.path.realpath('plugins'))
+
+sign_pkcs7 = importlib.import_module('sign-pkcs7')
+
+def _bench_mode(sign, blobs):
+    start = time.perf_counter()
+    for blob in blobs:
+        sign(blob)
+    return len(blobs) / (time.perf_counter() - start)
+
+def main():
+
+    # number and size of the blobs to sign
+    cnt = 100
+    if len(sys.argv) > 1:
+        cnt = int(sys.argv[1])
+    size = 64 * 1024
+    if len(sys.argv) > 2:
+        size = int(sys.argv[2])
+    privkey = 'contrib/secret.key'
+    certificate = 'contrib/client.pem'
+    blobs = [os.urandom(size) for _ in range(cnt)]
+
+    print('Signing %i blobs of %i bytes' % (cnt, size))
+    rate = _bench_mode(lambda blob: sign_pkcs7._sign_blob_certtool(blob, privkey, certificate), blobs)
+    print('%-12s %8.1f signatures/s' % ('certtool', rate))
+    if not sign_pkcs7.pkcs7:
+        print('cryptography not available, skipping in-process signing')
+        return
+    signer = sign_pkcs7.Pkcs7Signer(privkey, certificate)
+    rate = _bench_mode(signer.sign, blobs)
+    print('%-12s %8.1f signatures/s' % ('in-process', rate))
+
+if __name__ == '__main__':
+    main()
@@ -9,22 +9,30 @@
 
 import os
 import sys
+import csv
+import gzip
+import shutil
 import hashlib
 import datetime
 
+from concurrent.futures import ThreadPoolExecutor
+
 from flask import render_template
 
 from cabarchive import CabArchive
 
-from lvfs import app, db, ploader
+from lvfs import app, db, ploader, uaclassifier, csumcache
 from lvfs.dbutils import _execute_count_star
 from lvfs.emails import send_email
+from lvfs.pluginloader import PluginError
 from lvfs.models import Remote, Firmware, Vendor, Client, AnalyticVendor
 from lvfs.models import AnalyticFirmware, Useragent, UseragentKind, Analytic, Report
 from lvfs.models import ComponentShardInfo, Test, Component, Category, Protocol, FirmwareEvent
 from lvfs.models import _get_datestr_from_datetime
 from lvfs.metadata import _metadata_update_targets, _metadata_update_pulp
-from lvfs.util import _event_log, _get_shard_path, _get_absolute_path
+from lvfs.metadata import _get_metadata_delta_filenames, _get_metadata_variant_filenames
+from lvfs.metadata import _get_metadata_guid_index_filename
+from lvfs.util import _event_log, _get_shard_path, _get_absolute_path, _markdown_cache
 from lvfs.uploadedfile import UploadedFile, MetadataInvalid
 
 def _regenerate_and_sign_metadata():
@@ -42,6 +50,13 @@ def _regenerate_and_sign_metadata():
                     continue
                 print('Marking remote %s as dirty due to %u' % (r.name, fw.firmware_id))
                 r.is_dirty = True
+
+        # the GUID index has only just been enabled, or has been lost
+        if not r.is_dirty and r.is_public:
+            fn = _get_metadata_guid_index_filename(r)
+            if fn and not os.path.exists(fn):
+                print('Marking remote %s as dirty as the GUID index is missing' % r.name)
+                r.is_dirty = True
         if r.is_dirty:
             remotes.append(r)
 
@@ -52,15 +67,25 @@ def _regenerate_and_sign_metadata():
     # update everything required
     for r in remotes:
         print('Updating: %s' % r.name)
-    _metadata_update_targets(remotes)
+    remotes_modified, timings = _metadata_update_targets(remotes)
     for r in remotes:
+        duration, duration_write = timings[r]
+        print('Generated %s in %.0fms (%.0fms writing)%s' % \
+              (r.name, duration * 1000, duration_write * 1000,
+               '' if r in remotes_modified else ', unchanged'))
+    if _markdown_cache.hit_rate is not None:
+        print('Markdown cache hit rate %.0f%%' % (_markdown_cache.hit_rate * 100))
+    for r in remotes_modified:
         if r.name == 'stable':
             _metadata_update_pulp()
 
-    # sign and sync
-    download_dir = app.config['DOWNLOAD_DIR']
-    for r in remotes:
-        ploader.file_modified(os.path.join(download_dir, r.filename))
+    # sign and sync, but only if the content is different to what is published
+    with ploader.deferred():
+        for r in remotes_modified:
+            ploader.files_modified(_get_metadata_variant_filenames(r) + _get_metadata_delta_filenames(r))
+
+            # the next run can skip this remote if nothing changes
+            r.checksum_metadata = remotes_modified[r]
 
     # mark as no longer dirty
     for r in remotes:
@@ -71,7 +96,7 @@ def _regenerate_and_sign_metadata():
     db.session.expire_all()
 
     # log what we did
-    for r in remotes:
+    for r in remotes_modified:
         _event_log('Signed metadata %s' % r.name)
 
 def _sign_fw(fw):
@@ -85,13 +110,15 @@ def _sign_fw(fw):
     except IOError as e:
         raise NotImplementedError('cannot read %s: %s' % (fn, str(e)))
 
-    # sign each component in the archive
+    # sign all the components in the archive together
     print('Signing: %s' % fn)
+    cabfiles = []
     for md in fw.mds:
         try:
-            ploader.archive_sign(cabarchive, cabarchive[md.filename_contents])
+            cabfiles.append(cabarchive[md.filename_contents])
         except KeyError as _:
             raise NotImplementedError('no {} firmware found'.format(md.filename_contents))
+    ploader.archive_sign_many(cabarchive, cabfiles)
 
     # overwrite old file
     cab_data = cabarchive.save()
@@ -111,6 +138,25 @@ def _sign_fw(fw):
     fw.signed_timestamp = datetime.datetime.utcnow()
     db.session.commit()
 
+def _sign_firmware_id(firmware_id):
+    """ Signs one firmware, returning False if it failed """
+    fw = db.session.query(Firmware).filter(Firmware.firmware_id == firmware_id).first()
+    print('Signing firmware %u...' % firmware_id)
+    try:
+        _sign_fw(fw)
+    except (NotImplementedError, PluginError, IOError) as e:
+        db.session.rollback()
+        print('Failed to sign firmware %u: %s' % (firmware_id, str(e)))
+        _event_log('Failed to sign firmware %s: %s' % (firmware_id, str(e)), is_important=True)
+        return False
+    _event_log('Signed firmware %s' % firmware_id)
+    return True
+
+def _sign_firmware_id_worker(firmware_id, batch):
+    # each thread has its own database session
+    with app.test_request_context(), ploader.deferred(batch):
+        return _sign_firmware_id(firmware_id)
+
 def _repair():
 
     # fix any timestamps that are incorrect
@@ -137,22 +183,19 @@ def _repair():
 
     # fix all the checksums and file sizes
     for fw in db.session.query(Firmware).all():
-        try:
-            with open(fw.filename_absolute, 'rb') as f:
-                checksum_pulp = hashlib.sha256(f.read()).hexdigest()
-                if checksum_pulp != fw.checksum_pulp:
-                    print('repairing checksum from {} to {}'.format(fw.checksum_pulp,
-                                                                    checksum_pulp))
-                    fw.checksum_pulp = checksum_pulp
-                    fw.mark_dirty()
+        checksum_pulp = csumcache.get(fw.filename_absolute)
+        if checksum_pulp:
+            if checksum_pulp != fw.checksum_pulp:
+                print('repairing checksum from {} to {}'.format(fw.checksum_pulp,
+                                                                checksum_pulp))
+                fw.checksum_pulp = checksum_pulp
+                fw.mark_dirty()
+            sz = os.path.getsize(fw.filename_absolute)
             for md in fw.mds:
-                sz = os.path.getsize(fw.filename_absolute)
                 if sz != md.release_download_size:
                     print('repairing size from {} to {}'.format(md.release_download_size, sz))
                     md.release_download_size = sz
                     md.fw.mark_dirty()
-        except FileNotFoundError as _:
-            pass
 
         # ensure the test has been added for the firmware type
         if not fw.is_deleted:
@@ -160,6 +203,7 @@ def _repair():
 
     # all done
     db.session.commit()
+    csumcache.save()
 
 def _regenerate_and_sign_firmware():
 
@@ -169,17 +213,28 @@ def _regenerate_and_sign_firmware():
     if not fws:
         return
 
-    # sign each firmware in each file
-    for fw in fws:
-        if fw.is_deleted:
-            continue
-        print('Signing firmware %u...' % fw.firmware_id)
-        _sign_fw(fw)
-        _event_log('Signed firmware %s' % fw.firmware_id)
+    # sign each firmware in each file, in parallel if required
+    firmware_ids = [fw.firmware_id for fw in fws if not fw.is_deleted]
+    workers = min(app.config.get('SIGNING_WORKERS', 1), len(firmware_ids))
+    with ploader.deferred() as batch:
+        if workers > 1:
+            db.session.commit()
+            ploader.load_plugins()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_sign_firmware_id_worker,
+                                            firmware_ids,
+                                            [batch] * len(firmware_ids)))
+        else:
+            results = list(map(_sign_firmware_id, firmware_ids))
 
     # drop caches in other sessions
     db.session.expire_all()
 
+    # the other firmware was still signed
+    failed_cnt = results.count(False)
+    if failed_cnt:
+        raise NotImplementedError('failed to sign %i firmware' % failed_cnt)
+
 def _purge_old_deleted_firmware():
 
     # find all unsigned firmware
@@ -200,6 +255,64 @@ def _purge_old_deleted_firmware():
     # all done
     db.session.commit()
 
+def _get_client_retention_datestr():
+    days = app.config.get('CLIENT_RETENTION_DAYS')
+    if not days:
+        return None
+    return _get_datestr_from_datetime(datetime.date.today() - datetime.timedelta(days=days))
+
+def _archive_clients_for_datestr(datestr):
+
+    # write to a temp file so a partial archive is never left behind; rows
+    # added for this day since it was last archived are appended as a new
+    # gzip member rather than replacing what was already archived
+    fn = os.path.join(app.config['CLIENT_ARCHIVE_DIR'], 'clients-%i.csv.gz' % datestr)
+    fn_tmp = fn + '.tmp'
+    exists = os.path.exists(fn)
+    if exists:
+        shutil.copyfile(fn, fn_tmp)
+    cnt = 0
+    with gzip.open(fn_tmp, 'at' if exists else 'wt', newline='') as f:
+        writer = csv.writer(f)
+        if not exists:
+            writer.writerow(['id', 'timestamp', 'addr', 'firmware_id', 'user_agent'])
+
+        # we have to break this into chunks to avoid having 4GB+ of rows
+        last_id = 0
+        while True:
+            rows = db.session.query(Client.id, Client.timestamp, Client.addr,
+                                    Client.firmware_id, Client.user_agent).\
+                                    filter(Client.datestr == datestr).\
+                                    filter(Client.id > last_id).\
+                                    order_by(Client.id).limit(10000).all()
+            if not rows:
+                break
+            for row in rows:
+                writer.writerow([row.id, row.timestamp.isoformat(), row.addr,
+                                 row.firmware_id, row.user_agent])
+            cnt += len(rows)
+            last_id = rows[-1].id
+    os.rename(fn_tmp, fn)
+    db.session.execute(Client.__table__.delete().where(Client.datestr == datestr))
+    db.session.commit()
+    print('archived %i clients for %s' % (cnt, datestr))
+
+def _archive_clients():
+
+    # keep everything
+    datestr_min = _get_client_retention_datestr()
+    if not datestr_min:
+        print('CLIENT_RETENTION_DAYS is not set, not archiving')
+        return
+    if not os.path.exists(app.config['CLIENT_ARCHIVE_DIR']):
+        os.makedirs(app.config['CLIENT_ARCHIVE_DIR'])
+
+    # the analytics for these days have already been generated
+    for datestr, in db.session.query(Client.datestr).\
+                        filter(Client.datestr < datestr_min).\
+                        distinct().order_by(Client.datestr).all():
+        _archive_clients_for_datestr(datestr)
+
 def _test_priority_sort_func(test):
     plugin = ploader.get_by_id(test.plugin_id)
     return plugin.priority
@@ -318,26 +431,6 @@ def _generate_stats_firmware_reports(fw):
     if fw.remote.is_public and fw.is_failure:
         _demote_back_to_embargo(fw)
 
-def _get_app_from_ua(ua):
-    # always exists
-    return ua.split(' ')[0]
-
-def _get_fwupd_from_ua(ua):
-    for part in ua.split(' '):
-        if part.startswith('fwupd/'):
-            return part[6:]
-    return 'Unknown'
-
-def _get_lang_distro_from_ua(ua):
-    start = ua.find('(')
-    end = ua.rfind(')')
-    if start == -1 or end == -1:
-        return None
-    parts = ua[start+1:end].split('; ')
-    if len(parts) != 3:
-        return None
-    return (parts[1], parts[2])
-
 def _generate_stats_shard_info(info):
     if info.cnt != len(info.shards):
         print('fixing %s: %i -> %i' % (info.name, info.cnt, len(info.shards)))
@@ -369,6 +462,12 @@ def _generate_stats_for_datestr(datestr, kinds=None):
                  'AnalyticFirmware',
                  'Useragent']
 
+    # the clients have been archived, so the existing values are all we have
+    datestr_min = _get_client_retention_datestr()
+    if datestr_min and datestr < datestr_min:
+        print('not generating for %s as clients are archived' % datestr)
+        return
+
     # update AnalyticVendor
     if 'AnalyticVendor' in kinds:
         for analytic in db.session.query(AnalyticVendor).filter(AnalyticVendor.datestr == datestr).all():
@@ -399,29 +498,28 @@ def _generate_stats_for_datestr(datestr, kinds=None):
         clients = db.session.query(Client.user_agent).\
                         filter(Client.datestr == datestr).all()
         for res in clients:
-            ua = res[0]
-            if not ua:
+            if not res[0]:
                 continue
+            info = uaclassifier.classify(res[0])
 
             # downloader app
-            ua_app = _get_app_from_ua(ua)
+            ua_app = info.app
             if ua_app not in ua_apps:
                 ua_apps[ua_app] = 1
             else:
                 ua_apps[ua_app] += 1
 
             # fwupd version
-            ua_fwupd = _get_fwupd_from_ua(ua)
+            ua_fwupd = info.fwupd_version or 'Unknown'
             if ua_fwupd not in ua_fwupds:
                 ua_fwupds[ua_fwupd] = 1
             else:
                 ua_fwupds[ua_fwupd] += 1
 
             # language and distro
-            ua_lang_distro = _get_lang_distro_from_ua(ua)
-            if ua_lang_distro:
-                ua_lang = ua_lang_distro[0]
-                ua_distro = ua_lang_distro[1]
+            if info.lang and info.distro:
+                ua_lang = info.lang
+                ua_distro = info.distro
                 if ua_lang not in ua_langs:
                     ua_langs[ua_lang] = 1
                 else:
@@ -442,10 +540,8 @@ def _generate_stats_for_datestr(datestr, kinds=None):
 
     # update Analytic
     if 'Analytic' in kinds:
-        analytic = db.session.query(Analytic).filter(Analytic.datestr == datestr).first()
-        if analytic:
-            db.session.delete(analytic)
-            db.session.commit()
+        db.session.query(Analytic).filter(Analytic.datestr == datestr).delete()
+        db.session.commit()
         db.session.add(Analytic(datestr, len(clients)))
         db.session.commit()
 
@@ -487,6 +583,13 @@ if __name__ == '__main__':
         except NotImplementedError as e:
             print(str(e))
             sys.exit(1)
+    if 'archiveclients' in sys.argv:
+        try:
+            with app.test_request_context():
+                _archive_clients()
+        except NotImplementedError as e:
+            print(str(e))
+            sys.exit(1)
     if 'fwchecks' in sys.argv:
         try:
             with app.test_request_context():
@@ -19,6 +19,13 @@ from flask_sqlalchemy import SQLAlchemy
 from werkzeug.local import LocalProxy
 
 from .pluginloader import Pluginloader
+from .clientqueue import ClientQueue
+from .resolver import FirmwareResolver
+from .downloadcounter import DownloadCounter
+from .geoiplookup import GeoIPLookup
+from .guidindex import GuidIndex
+from .checksumcache import ChecksumCache
+from .useragent import UserAgentClassifier
 from .util import _error_internal, _event_log
 from .dbutils import drop_db, init_db, anonymize_db
 
@@ -62,7 +69,25 @@ message_flashed.connect(flash_save_eventlog, app)
 lm = LoginManager()
 lm.init_app(app)
 
-ploader = Pluginloader('plugins')
+ploader = Pluginloader('plugins', concurrency=app.config.get('PLUGIN_CONCURRENCY'))
+
+uaclassifier = UserAgentClassifier(app)
+
+clientq = ClientQueue(app, db, uaclassifier)
+
+fwresolver = FirmwareResolver(app, db)
+
+dlcounter = DownloadCounter(app, db, clientq)
+
+geolookup = GeoIPLookup(app)
+
+guidindex = GuidIndex(app)
+
+csumcache = ChecksumCache(app)
+
+@app.teardown_request
+def flush_client_queue(unused_exception=None):
+    clientq.flush_if_stale()
 
 @app.teardown_appcontext
 def shutdown_session(unused_exception=None):
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+
+import os
+import hashlib
+import json
+import threading
+
+from .lrucache import LruCache
+
+class ChecksumCache:
+
+    """
+    The SHA256 of files, only reading each file again if it has changed.
+
+    Files are read in fixed-size chunks so that memory use does not depend on
+    the file size. Checksums are keyed by the path, size, mtime and inode, and
+    if CHECKSUM_CACHE_FILE is set they can be saved so that the next cron run
+    does not have to read every file on the server again.
+    """
+
+    def __init__(self, app, chunk_size=0x10000):
+        self._app = app
+        self._chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._cache = LruCache(max_size=app.config.get('CHECKSUM_CACHE_SIZE', 16384))
+        self._saved = None
+
+    def _get_saved(self):
+        """ Loads the checksums saved by an earlier process """
+        if self._saved is not None:
+            return self._saved
+        self._saved = {}
+        fn = self._app.config.get('CHECKSUM_CACHE_FILE')
+        if fn and os.path.exists(fn):
+            try:
+                with open(fn, 'r') as f:
+                    self._saved = json.load(f)
+            except (OSError, ValueError) as _:
+                pass
+        return self._saved
+
+    def _hash_file(self, path):
+        csum = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self._chunk_size), b''):
+                csum.update(chunk)
+        return csum.hexdigest()
+
+    def get(self, path):
+        """ Returns the SHA256 of a file, or None if it does not exist """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError as _:
+            return None
+        key = [st.st_size, st.st_mtime_ns, st.st_ino]
+        checksum = self._cache.get((path, tuple(key)))
+        if checksum:
+            return checksum
+        with self._lock:
+            saved = self._get_saved().get(path)
+        if saved and saved[:3] == key:
+            checksum = saved[3]
+        else:
+            checksum = self._hash_file(path)
+            with self._lock:
+                self._saved[path] = key + [checksum]
+        self._cache.set((path, tuple(key)), checksum)
+        return checksum
+
+    def save(self):
+        """ Saves the checksums of files that still exist for the next process """
+        fn = self._app.config.get('CHECKSUM_CACHE_FILE')
+        if not fn:
+            return
+        with self._lock:
+            saved = {}
+            for path, value in self._get_saved().items():
+                if os.path.exists(path):
+                    saved[path] = value
+            self._saved = saved
+        with open(fn + '.tmp', 'w') as f:
+            json.dump(saved, f)
+        os.rename(fn + '.tmp', fn)
+
+    def __repr__(self):
+        return 'ChecksumCache({})'.format(self._cache)
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+
+import atexit
+import datetime
+import threading
+
+from collections import defaultdict
+
+from sqlalchemy import and_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+class ClientQueue:
+
+    """
+    A write-behind buffer of firmware downloads.
+
+    Each download is appended to an in-process list and then written to the
+    database in bulk when either CLIENT_QUEUE_SIZE events are pending or the
+    oldest pending event is more than CLIENT_QUEUE_TIMEOUT seconds old. A timer
+    is started for the first event added to an empty buffer so that an idle
+    worker still writes what it holds when the timeout expires.
+
+    At most CLIENT_QUEUE_MAX events are ever held in memory, so the worst case
+    loss if the process is killed without running the atexit handler is
+    bounded; anything added when the buffer is full is dropped and counted.
+
+    Once written, the per-day firmware and user agent analytics are also
+    incremented so that the daily stats do not have to scan the clients table.
+    """
+
+    def __init__(self, app, db, uaclassifier):
+        self._app = app
+        self._db = db
+        self._uaclassifier = uaclassifier
+        self._lock = threading.Lock()
+        self._events = []
+        self._oldest_ts = None
+        self._timer = None
+        self.flushed_cnt = 0
+        self.dropped_cnt = 0
+        atexit.register(self._flush_atexit)
+
+    def __len__(self):
+        return len(self._events)
+
+    def _should_flush(self, now):
+        if len(self._events) >= self._app.config.get('CLIENT_QUEUE_SIZE', 1):
+            return True
+        if not self._oldest_ts:
+            return False
+        timeout = self._app.config.get('CLIENT_QUEUE_TIMEOUT', 10)
+        return (now - self._oldest_ts).total_seconds() >= timeout
+
+    def add(self, firmware_id, addr, user_agent=None):
+        """ Queues a download, returning False if the event was dropped """
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            if len(self._events) >= self._app.config.get('CLIENT_QUEUE_MAX', 10000):
+                self.dropped_cnt += 1
+                return False
+            if not self._events:
+                self._oldest_ts = now
+                self._start_timer()
+            self._events.append((firmware_id, addr, user_agent, now))
+            should_flush = self._should_flush(now)
+        if should_flush:
+            self.flush()
+        return True
+
+    def _start_timer(self):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(self._app.config.get('CLIENT_QUEUE_TIMEOUT', 10),
+                                      self._flush_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_timer(self):
+        with self._app.app_context():
+            self.flush()
+
+    def flush_if_stale(self):
+        """ Writes all pending events if the oldest is older than CLIENT_QUEUE_TIMEOUT """
+        with self._lock:
+            should_flush = self._should_flush(datetime.datetime.utcnow())
+        if not should_flush:
+            return 0
+        return self.flush()
+
+    def flush(self):
+        """ Writes all pending events to the database, returning the number written """
+
+        # take ownership of everything pending so new events are not blocked
+        with self._lock:
+            events = self._events
+            self._events = []
+            self._oldest_ts = None
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        if not events:
+            return 0
+
+        # one multi-row INSERT and one UPDATE per firmware
+        from .models import Client, Firmware, _get_datestr_from_datetime
+        rows = []
+        counts = defaultdict(int)
+        for firmware_id, addr, user_agent, timestamp in events:
+            rows.append({'firmware_id': firmware_id,
+                         'addr': addr,
+                         'user_agent': user_agent,
+                         'timestamp': timestamp,
+                         'datestr': _get_datestr_from_datetime(timestamp)})
+            counts[firmware_id] += 1
+        try:
+            self._db.session.execute(Client.__table__.insert(), rows)
+            for firmware_id in sorted(counts):
+                self._db.session.execute(Firmware.__table__.update().\
+                        where(Firmware.firmware_id == firmware_id).\
+                        values(download_cnt=Firmware.download_cnt + counts[firmware_id]))
+            self._db.session.commit()
+        except SQLAlchemyError as e:
+            self._db.session.rollback()
+            with self._lock:
+                self.dropped_cnt += len(events)
+            self._app.logger.error('failed to write %i download events: %s', len(events), str(e))
+            return 0
+        with self._lock:
+            self.flushed_cnt += len(events)
+
+        # the downloads are safe, and the nightly stats will fix up any error
+        try:
+            self._update_rollups(rows)
+            self._db.session.commit()
+        except SQLAlchemyError as e:
+            self._db.session.rollback()
+            self._app.logger.warning('failed to update download analytics: %s', str(e))
+        return len(events)
+
+    def _increment(self, table, rows):
+        """ Adds the cnt of each row to the row with the same keys, inserting it if required """
+        if not rows:
+            return
+
+        # the unique index merges flushes from other processes in one statement
+        if self._db.session.get_bind().dialect.name == 'mysql':
+            stmt = mysql_insert(table).values(rows)
+            self._db.session.execute(stmt.on_duplicate_key_update(cnt=table.c.cnt + stmt.inserted.cnt))
+            return
+
+        # elsewhere a concurrent duplicate fails the unique index and is rolled back
+        for row in rows:
+            keys = [key for key in row if key != 'cnt']
+            res = self._db.session.execute(table.update().\
+                    where(and_(*[table.c[key] == row[key] for key in keys])).\
+                    values(cnt=table.c.cnt + row['cnt']))
+            if not res.rowcount:
+                self._db.session.execute(table.insert(), row)
+
+    def _update_rollups(self, rows):
+        from .models import Analytic, AnalyticFirmware, Useragent, UseragentKind
+        from .models import _get_useragent_value_hash
+
+        # aggregate everything first
+        cnt_days = defaultdict(int)
+        cnt_fws = defaultdict(int)
+        cnt_uas = defaultdict(int)
+        for row in rows:
+            datestr = row['datestr']
+            cnt_days[datestr] += 1
+            cnt_fws[(datestr, row['firmware_id'])] += 1
+            if not row['user_agent']:
+                continue
+            ua = self._uaclassifier.classify(row['user_agent'])
+            cnt_uas[(datestr, UseragentKind.APP.value, ua.app)] += 1
+            cnt_uas[(datestr, UseragentKind.FWUPD.value, ua.fwupd_version or 'Unknown')] += 1
+            if ua.lang and ua.distro:
+                cnt_uas[(datestr, UseragentKind.LANG.value, ua.lang)] += 1
+                cnt_uas[(datestr, UseragentKind.DISTRO.value, ua.distro)] += 1
+
+        # one upsert for each table, in a stable order to avoid deadlocks
+        self._increment(Analytic.__table__,
+                        [{'datestr': datestr, 'cnt': cnt_days[datestr]}
+                         for datestr in sorted(cnt_days)])
+        self._increment(AnalyticFirmware.__table__,
+                        [{'datestr': datestr, 'firmware_id': firmware_id,
+                          'cnt': cnt_fws[(datestr, firmware_id)]}
+                         for datestr, firmware_id in sorted(cnt_fws)])
+        self._increment(Useragent.__table__,
+                        [{'datestr': datestr, 'kind': kind, 'value': value,
+                          'value_hash': _get_useragent_value_hash(value),
+                          'cnt': cnt_uas[(datestr, kind, value)]}
+                         for datestr, kind, value in sorted(cnt_uas)])
+
+    def _flush_atexit(self):
+        if not self._events:
+            return
+        with self._app.app_context():
+            self.flush()
+
+    def __repr__(self):
+        return 'ClientQueue(pending={},flushed={},dropped={})'.format(len(self._events),
+                                                                    self.flushed_cnt,
+                                                                    self.dropped_cnt)
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+
+import datetime
+import threading
+import time
+
+from sqlalchemy import and_, case, func
+
+class DownloadWindow:
+
+    """ A rolling count of events using one bucket per minute """
+
+    def __init__(self, minutes=1440):
+        self.buckets = [0] * minutes
+        self.minute = 0
+        self.total = 0
+        self.reconciled = 0
+
+    def _advance(self, minute):
+        if minute <= self.minute:
+            return
+        if minute - self.minute >= len(self.buckets):
+            self.buckets = [0] * len(self.buckets)
+            self.total = 0
+        else:
+            for i in range(self.minute + 1, minute + 1):
+                idx = i % len(self.buckets)
+                self.total -= self.buckets[idx]
+                self.buckets[idx] = 0
+        self.minute = minute
+
+    def add(self, minute, cnt=1):
+        self._advance(minute)
+        if minute <= self.minute - len(self.buckets):
+            return
+        self.buckets[minute % len(self.buckets)] += cnt
+        self.total += cnt
+
+    def count(self, minute):
+        self._advance(minute)
+        return self.total
+
+def _datetime_from_minute(minute):
+    return datetime.datetime.utcfromtimestamp(minute * 60)
+
+class DownloadCounter:
+
+    """
+    Per-firmware download counts over the last 24 hours.
+
+    Only firmware with download limits are tracked. The in-memory window is
+    seeded from the clients table on first use and then reconciled again every
+    DOWNLOAD_COUNTER_RECONCILE seconds so that downloads served by other
+    processes are included.
+    """
+
+    def __init__(self, app, db, clientq):
+        self._app = app
+        self._db = db
+        self._clientq = clientq
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def _reconcile(self, firmware_id, now):
+        from .models import Client
+
+        # make sure our own pending downloads are in the database
+        self._clientq.flush()
+        window = DownloadWindow()
+        window.minute = now // 60
+
+        # only the minutes that expire before the next reconcile need their own
+        # bucket, the rest of the day is counted in the newest minute it covers
+        timeout = self._app.config.get('DOWNLOAD_COUNTER_RECONCILE', 300)
+        first = window.minute - len(window.buckets) + 1
+        edges = list(range(first, min(first + timeout // 60 + 2, window.minute)))
+        edges += [window.minute, window.minute + 1]
+        bounds = list(zip(edges, edges[1:]))
+        cols = []
+        for start, end in bounds:
+            cols.append(func.count(case([(and_(Client.timestamp >= _datetime_from_minute(start),
+                                               Client.timestamp < _datetime_from_minute(end)), 1)])))
+        cnts = self._db.session.query(*cols).\
+                        filter(Client.firmware_id == firmware_id).\
+                        filter(Client.timestamp >= _datetime_from_minute(first)).one()
+        for (_, end), cnt in zip(bounds, cnts):
+            if cnt:
+                window.add(end - 1, cnt)
+        window.reconciled = now
+        return window
+
+    def count(self, firmware_id):
+        """ Returns the number of downloads in the last 24 hours """
+        now = int(time.time())
+        with self._lock:
+            window = self._windows.get(firmware_id)
+        timeout = self._app.config.get('DOWNLOAD_COUNTER_RECONCILE', 300)
+        if not window or now - window.reconciled > timeout:
+            window = self._reconcile(firmware_id, now)
+            with self._lock:
+                self._windows[firmware_id] = window
+        with self._lock:
+            return window.count(now // 60)
+
+    def add(self, firmware_id):
+        """ Records a download, which is only needed for firmware with limits """
+        now = int(time.time())
+        with self._lock:
+            window = self._windows.get(firmware_id)
+            if window:
+                window.add(now // 60)
+
+    def __len__(self):
+        return len(self._windows)
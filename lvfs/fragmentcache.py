@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+
+import os
+import time
+
+from .lrucache import LruCache
+
+class FragmentCache:
+
+    """
+    Serialized XML fragments keyed by a content hash.
+
+    Fragments are kept in memory, and if METADATA_FRAGMENT_DIR is set also
+    saved to disk so that the next cron run can reuse them. Files that have not
+    been used for METADATA_FRAGMENT_MAX_AGE seconds are removed by prune().
+    """
+
+    def __init__(self, app):
+        self._app = app
+        self._cache = LruCache(max_size=app.config.get('METADATA_FRAGMENT_CACHE_SIZE', 16384))
+        self.rebuilt_cnt = 0
+
+    def _get_path(self, key):
+        fragment_dir = self._app.config.get('METADATA_FRAGMENT_DIR')
+        if not fragment_dir:
+            return None
+        return os.path.join(fragment_dir, key + '.xml')
+
+    def get(self, key):
+        """ Returns the serialized fragment, or None if not cached """
+        blob = self._cache.get(key)
+        if blob:
+            return blob
+        path = self._get_path(key)
+        if not path:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            os.utime(path)
+        except OSError as _:
+            return None
+        self._cache.set(key, blob)
+        return blob
+
+    def set(self, key, blob):
+        self.rebuilt_cnt += 1
+        self._cache.set(key, blob)
+        path = self._get_path(key)
+        if not path:
+            return
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(blob)
+        os.rename(path + '.tmp', path)
+
+    def prune(self):
+        """ Removes fragments on disk that have not been used recently """
+        fragment_dir = self._app.config.get('METADATA_FRAGMENT_DIR')
+        if not fragment_dir or not os.path.exists(fragment_dir):
+            return 0
+        cnt = 0
+        max_age = self._app.config.get('METADATA_FRAGMENT_MAX_AGE', 7 * 24 * 60 * 60)
+        now = time.time()
+        for basename in os.listdir(fragment_dir):
+            path = os.path.join(fragment_dir, basename)
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+                    cnt += 1
+            except OSError as _:
+                pass
+        return cnt
+
+    def clear(self):
+        self._cache.clear()
+
+    def __repr__(self):
+        return 'FragmentCache(rebuilt={},{})'.format(self.rebuilt_cnt, self._cache)
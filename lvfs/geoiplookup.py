@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+
+import os
+import threading
+import time
+
+import GeoIP
+
+from .lrucache import LruCache
+
+_MISSING = object()
+
+class GeoIPLookup:
+
+    """
+    A process-wide country lookup.
+
+    The database is only loaded into memory on first use, and then again if
+    the file specified by GEOIP_DATABASE is replaced on disk. Results are
+    cached by address, and the time spent doing uncached lookups is recorded.
+    """
+
+    def __init__(self, app):
+        self._app = app
+        self._lock = threading.Lock()
+        self._geo = None
+        self._mtime = None
+        self._checked_ts = 0
+        self._cache = LruCache(max_size=app.config.get('GEOIP_CACHE_SIZE', 65536))
+        self.lookup_cnt = 0
+        self.lookup_time = 0.0
+        self.lookup_time_max = 0.0
+
+    def _get_database(self):
+
+        # only check the file every so often
+        now = time.monotonic()
+        if self._geo and now - self._checked_ts < self._app.config.get('GEOIP_RECHECK', 60):
+            return self._geo
+        self._checked_ts = now
+
+        # has the file changed
+        fn = self._app.config.get('GEOIP_DATABASE')
+        mtime = None
+        if fn:
+            try:
+                mtime = os.stat(fn).st_mtime_ns
+            except OSError as _:
+                fn = None
+        if self._geo and mtime == self._mtime:
+            return self._geo
+
+        # load into memory
+        if fn:
+            self._geo = GeoIP.open(fn, GeoIP.GEOIP_MEMORY_CACHE)
+        else:
+            self._geo = GeoIP.new(GeoIP.GEOIP_MEMORY_CACHE)
+        self._mtime = mtime
+        self._cache.clear()
+        return self._geo
+
+    def country_code_by_addr(self, addr):
+        """ Returns the ISO 3166 country code, or None if unknown """
+        country_code = self._cache.get(addr, _MISSING)
+        if country_code is not _MISSING:
+            return country_code
+        with self._lock:
+            geo = self._get_database()
+            start = time.perf_counter()
+            country_code = geo.country_code_by_addr(addr)
+            elapsed = time.perf_counter() - start
+            self.lookup_cnt += 1
+            self.lookup_time += elapsed
+            if elapsed > self.lookup_time_max:
+                self.lookup_time_max = elapsed
+        self._cache.set(addr, country_code)
+        return country_code
+
+    @property
+    def lookup_time_avg(self):
+        if not self.lookup_cnt:
+            return None
+        return self.lookup_time / self.lookup_cnt
+
+    def __repr__(self):
+        return 'GeoIPLookup(lookups={},avg={},max={},cache={})'.format(self.lookup_cnt,
+                                                                       self.lookup_time_avg,
+                                                                       self.lookup_time_max,
+                                                                       self._cache)
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+
+import json
+import os
+import threading
+
+from lxml import etree as ET
+
+from .lrucache import LruCache
+
+class GuidIndex:
+
+    """
+    Returns the AppStream components that provide any of a set of GUIDs.
+
+    The index for each public remote is written to METADATA_GUID_DIR when the
+    metadata is regenerated, and loaded again here when the file changes.
+    Most clients have one of only a few sets of hardware, so the responses
+    are also cached.
+    """
+
+    def __init__(self, app):
+        self._app = app
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._cache = LruCache(max_size=app.config.get('METADATA_GUID_CACHE_SIZE', 1024))
+
+    def _get_index(self, remote_name):
+        guid_dir = self._app.config.get('METADATA_GUID_DIR')
+        if not guid_dir:
+            return None
+        fn = os.path.join(guid_dir, remote_name + '.json')
+        try:
+            mtime = os.stat(fn).st_mtime_ns
+        except OSError as _:
+            return None
+        with self._lock:
+            mtime_old, index = self._indexes.get(remote_name, (None, None))
+            if mtime == mtime_old:
+                return index
+        with open(fn, 'r') as f:
+            index = json.load(f)
+        with self._lock:
+            self._indexes[remote_name] = (mtime, index)
+        return index
+
+    def query(self, remote_name, guids):
+        """ Returns the XML document, or None if the remote is not indexed """
+        index = self._get_index(remote_name)
+        if not index:
+            return None
+        guids = tuple(sorted(set([guid.lower() for guid in guids])))
+        key = (remote_name, index['checksum'], guids)
+        blob = self._cache.get(key)
+        if blob:
+            return blob
+
+        # the same format as the full metadata
+        appstream_ids = set()
+        for guid in guids:
+            appstream_ids.update(index['guids'].get(guid, []))
+        root = ET.Element('components')
+        root.set('origin', 'lvfs')
+        root.set('version', '0.9')
+        for appstream_id in sorted(appstream_ids):
+            root.append(ET.fromstring(index['components'][appstream_id]))
+        blob = ET.tostring(root,
+                           encoding='UTF-8',
+                           xml_declaration=True,
+                           pretty_print=True)
+        self._cache.set(key, blob)
+        return blob
+
+    def __repr__(self):
+        return 'GuidIndex({})'.format(self._cache)
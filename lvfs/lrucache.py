@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+
+import threading
+import time
+
+from collections import OrderedDict
+
+class LruCache:
+
+    """ A thread-safe bounded cache, optionally with a maximum entry age """
+
+    def __init__(self, max_size=1024, max_age=None):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                ts, value = self._items[key]
+            except KeyError as _:
+                self.misses += 1
+                return default
+            if self.max_age and time.monotonic() - ts > self.max_age:
+                del self._items[key]
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if not total:
+            return None
+        return self.hits / total
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return 'LruCache(size={},hits={},misses={})'.format(len(self._items),
+                                                          self.hits,
+                                                          self.misses)
@@ -5,25 +5,325 @@
 #
 # SPDX-License-Identifier: GPL-2.0+
 #
-# pylint: disable=too-many-statements,too-many-locals,too-many-nested-blocks
+# pylint: disable=too-many-statements,too-many-locals,too-many-nested-blocks,singleton-comparison
 
 import os
+import gzip
 import hashlib
+import json
+import lzma
+import time
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree as ET
+from sqlalchemy.orm import selectinload
 
-from lvfs import app, db
+try:
+    import zstandard
+except ImportError as _:
+    zstandard = None
 
-from .models import Firmware, Vendor, Remote
-from .util import _get_settings, _xml_from_markdown
+from lvfs import app, db, csumcache
 
-def _generate_metadata_kind(filename, fws, firmware_baseuri='', local=False):
-    """ Generates AppStream metadata of a specific kind """
+from .fragmentcache import FragmentCache
+from .models import Firmware, Restriction, Remote
+from .util import _get_settings, _xml_from_markdown
 
-    root = ET.Element('components')
-    root.set('origin', 'lvfs')
-    root.set('version', '0.9')
+_fragments = FragmentCache(app)
+
+def _get_vendor_restrictions():
+    """ Returns a map of vendor_id:[restriction values] """
+    restrictions = defaultdict(list)
+    for vendor_id, value in db.session.query(Restriction.vendor_id, Restriction.value).\
+                                order_by(Restriction.restriction_id):
+        restrictions[vendor_id].append(value)
+    return restrictions
+
+def _get_component_vendor_ids(mds, vendor_restrictions):
+    """ Returns the vendor-id restrictions used for the component """
+    vendor_ids = None
+    for md in mds:
+        if md.fw.vendor_id in vendor_restrictions:
+            vendor_ids = vendor_restrictions[md.fw.vendor_id]
+    return vendor_ids
+
+def _get_firmware_for_export(remote):
+    """ Returns the firmware in a remote with everything needed to generate metadata """
+    return db.session.query(Firmware).\
+                join(Remote, Firmware.remote_id == Remote.remote_id).\
+                filter(remote.check_fw_clause()).\
+                filter(Remote.name != 'deleted').\
+                filter(Firmware.signed_timestamp != None).\
+                options(selectinload('mds').selectinload('requirements'),
+                        selectinload('mds').selectinload('device_checksums'),
+                        selectinload('mds').selectinload('guids'),
+                        selectinload('mds').joinedload('category')).all()
+
+def _generate_metadata_component(mds, firmware_baseuri='', local=False, vendor_ids=None):
+    """ Generates the AppStream <component> for the latest releases of a device """
+
+    # assume all the components have the same parent firmware information
+    md = mds[0]
+    component = ET.Element('component')
+    component.set('type', 'firmware')
+    ET.SubElement(component, 'id').text = md.appstream_id
+    # until all front ends support <category> append the suffix */
+    ET.SubElement(component, 'name').text = md.name_with_category
+    ET.SubElement(component, 'summary').text = md.summary
+    ET.SubElement(component, 'developer_name').text = md.developer_name
+    if md.description:
+        component.append(_xml_from_markdown(md.description))
+    ET.SubElement(component, 'project_license').text = md.project_license
+    if md.url_homepage:
+        child = ET.SubElement(component, 'url')
+        child.set('type', 'homepage')
+        child.text = md.url_homepage
+    for md in mds:
+        if md.priority:
+            component.set('priority', str(md.priority))
+
+    # add requires for each allowed vendor_ids
+    elements = {}
+    if vendor_ids:
+
+        # allow specifying more than one ID
+        child = ET.Element('firmware')
+        child.text = 'vendor-id'
+        if len(vendor_ids) == 1:
+            child.set('compare', 'eq')
+        else:
+            child.set('compare', 'regex')
+        child.set('version', '|'.join(vendor_ids))
+        elements['vendor-id'] = child
+
+    # add requires for <firmware> or fwupd version
+    for md in mds:
+        for rq in md.requirements:
+            if rq.kind == 'hardware':
+                continue
+            child = ET.Element(rq.kind)
+            if rq.value:
+                child.text = rq.value
+            if rq.compare:
+                child.set('compare', rq.compare)
+            if rq.version:
+                child.set('version', rq.version)
+            elements[rq.kind + str(rq.value)] = child
+
+    # add a single requirement for <hardware>
+    rq_hws = []
+    for md in mds:
+        for rq in md.requirements:
+            if rq.kind == 'hardware' and rq.value not in rq_hws:
+                rq_hws.append(rq.value)
+    if rq_hws:
+        child = ET.Element('hardware')
+        child.text = '|'.join(rq_hws)
+        elements['hardware'] = child
+
+    # requires shared by all releases
+    if elements:
+        parent = ET.SubElement(component, 'requires')
+        for key in elements:
+            parent.append(elements[key])
+
+    # screenshot shared by all releases
+    elements = {}
+    for md in mds:
+        if not md.screenshot_url and not md.screenshot_caption:
+            continue
+        # try to dedupe using the URL and then the caption
+        key = md.screenshot_url
+        if not key:
+            key = md.screenshot_caption
+        if key not in elements:
+            child = ET.Element('screenshot')
+            if not elements:
+                child.set('type', 'default')
+            if md.screenshot_caption:
+                ET.SubElement(child, 'caption').text = md.screenshot_caption
+            if md.screenshot_url:
+                ET.SubElement(child, 'image').text = md.screenshot_url
+            elements[key] = child
+    if elements:
+        parent = ET.SubElement(component, 'screenshots')
+        for key in elements:
+            parent.append(elements[key])
+
+    # add each release
+    releases = ET.SubElement(component, 'releases')
+    for md in mds:
+        if not md.version:
+            continue
+        rel = ET.SubElement(releases, 'release')
+        if md.release_timestamp:
+            rel.set('timestamp', str(md.release_timestamp))
+        if md.release_urgency and md.release_urgency != 'unknown':
+            rel.set('urgency', md.release_urgency)
+        if md.version:
+            rel.set('version', md.version)
+        ET.SubElement(rel, 'location').text = firmware_baseuri + md.fw.filename
+
+        # add container checksum
+        if md.fw.checksum_signed or local:
+            csum = ET.SubElement(rel, 'checksum')
+            #metadata intended to be used locally won't be signed
+            if local:
+                csum.text = md.fw.checksum_upload
+            else:
+                csum.text = md.fw.checksum_signed
+            csum.set('type', 'sha1')
+            csum.set('filename', md.fw.filename)
+            csum.set('target', 'container')
+
+        # add content checksum
+        if md.checksum_contents:
+            csum = ET.SubElement(rel, 'checksum')
+            csum.text = md.checksum_contents
+            csum.set('type', 'sha1')
+            csum.set('filename', md.filename_contents)
+            csum.set('target', 'content')
+
+        # add all device checksums
+        for csum in md.device_checksums:
+            n_csum = ET.SubElement(rel, 'checksum')
+            n_csum.text = csum.value
+            n_csum.set('type', csum.kind.lower())
+            n_csum.set('target', 'device')
+
+        # add long description
+        if md.release_description:
+            rel.append(_xml_from_markdown(md.release_description))
+
+        # add details URL if set
+        if md.details_url:
+            child = ET.SubElement(rel, 'url')
+            child.set('type', 'details')
+            child.text = md.details_url
+
+        # add source URL if set
+        if md.source_url:
+            child = ET.SubElement(rel, 'url')
+            child.set('type', 'source')
+            child.text = md.source_url
+
+        # add sizes if set
+        if md.release_installed_size:
+            sz = ET.SubElement(rel, 'size')
+            sz.set('type', 'installed')
+            sz.text = str(md.release_installed_size)
+        if md.release_download_size:
+            sz = ET.SubElement(rel, 'size')
+            sz.set('type', 'download')
+            sz.text = str(md.release_download_size)
+
+    # deliberately not including <category> here until 2020-01-01
+    if False:                       # pylint: disable=using-constant-test
+        cats = [] #lgtm [py/unreachable-statement]
+        for md in mds:
+            if not md.category:
+                continue
+            if md.category.value not in cats:
+                cats.append(md.category.value)
+            if md.category.fallbacks:
+                for fallback in md.category.fallbacks.split(','):
+                    if fallback not in cats:
+                        cats.append(fallback)
+        if cats:
+            categories = ET.SubElement(component, 'categories')
+            for cat in cats:
+                ET.SubElement(categories, 'category').text = cat
+
+    # provides shared by all releases
+    elements = {}
+    for md in mds:
+        for guid in md.guids:
+            if guid.value in elements:
+                continue
+            child = ET.Element('firmware')
+            child.set('type', 'flashed')
+            child.text = guid.value
+            elements[guid.value] = child
+    if elements:
+        parent = ET.SubElement(component, 'provides')
+        for key in sorted(elements):
+            parent.append(elements[key])
+
+    # metadata shared by all releases
+    elements = {}
+    for md in mds:
+        if md.inhibit_download:
+            if 'LVFS::InhibitDownload' in elements:
+                continue
+            child = ET.Element('value')
+            child.set('key', 'LVFS::InhibitDownload')
+            elements['LVFS::InhibitDownload'] = child
+        if md.version_format:
+            if 'LVFS::VersionFormat' in elements:
+                continue
+            child = ET.Element('value')
+            child.set('key', 'LVFS::VersionFormat')
+            child.text = md.version_format
+            elements['LVFS::VersionFormat'] = child
+    if elements:
+        parent = ET.SubElement(component, 'custom')
+        for key in elements:
+            parent.append(elements[key])
+
+    return component
+
+# increment this when _generate_metadata_component changes what it outputs,
+# as the saved fragments are otherwise reused by the next cron run
+_METADATA_FRAGMENT_VERSION = 2
+
+def _get_row_values(obj):
+    """ Returns the values of all the columns of a database object """
+    if not obj:
+        return None
+    return [getattr(obj, attr.key) for attr in obj.__mapper__.column_attrs]
+
+def _get_metadata_component_key(mds, firmware_baseuri, local, vendor_ids):
+    """ Returns a key that changes when the generated component would change """
+    key = [_METADATA_FRAGMENT_VERSION, mds[0].appstream_id, firmware_baseuri, local, vendor_ids]
+    for md in mds:
+        key.append((_get_row_values(md),
+                    _get_row_values(md.category),
+                    [_get_row_values(rq) for rq in md.requirements],
+                    [_get_row_values(guid) for guid in md.guids],
+                    [_get_row_values(csum) for csum in md.device_checksums],
+                    md.fw.firmware_id,
+                    md.fw.filename,
+                    md.fw.checksum_upload,
+                    md.fw.checksum_signed,
+                    str(md.fw.signed_timestamp)))
+    return hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+
+def _get_metadata_fragment(mds, firmware_baseuri='', local=False, vendor_ids=None):
+    """ Returns the serialized <component>, from the fragment cache where possible """
+
+    # not from the database, e.g. when generating local metadata
+    for md in mds:
+        if not md.component_id:
+            component = _generate_metadata_component(mds, firmware_baseuri, local, vendor_ids)
+            return ET.tostring(component, encoding='utf-8')
+
+    # rebuild if any of the firmware has been modified
+    key = _get_metadata_component_key(mds, firmware_baseuri, local, vendor_ids)
+    blob = None
+    if not any([md.fw.is_dirty for md in mds]):
+        blob = _fragments.get(key)
+    if blob:
+        return blob
+    component = _generate_metadata_component(mds, firmware_baseuri, local, vendor_ids)
+    blob = ET.tostring(component, encoding='utf-8')
+    _fragments.set(key, blob)
+    return blob
+
+def _get_metadata_fragments(fws, firmware_baseuri='', local=False, vendor_restrictions=None):
+    """ Returns the serialized <component> elements for some firmware, in
+    order and keyed by the appstream_id """
 
     # build a map of appstream_id:mds
     components = defaultdict(list)
@@ -33,235 +333,325 @@ def _generate_metadata_kind(filename, fws, firmware_baseuri='', local=False):
 
     # process each component in version order, but only include the latest 5
     # releases to keep the metadata size sane
+    fragments = OrderedDict()
     for appstream_id in sorted(components):
         mds = sorted(components[appstream_id], reverse=True)[:5]
-        # assume all the components have the same parent firmware information
-        md = mds[0]
-        component = ET.SubElement(root, 'component')
-        component.set('type', 'firmware')
-        ET.SubElement(component, 'id').text = md.appstream_id
-        # until all front ends support <category> append the suffix */
-        ET.SubElement(component, 'name').text = md.name_with_category
-        ET.SubElement(component, 'summary').text = md.summary
-        ET.SubElement(component, 'developer_name').text = md.developer_name
-        if md.description:
-            component.append(_xml_from_markdown(md.description))
-        ET.SubElement(component, 'project_license').text = md.project_license
-        if md.url_homepage:
-            child = ET.SubElement(component, 'url')
-            child.set('type', 'homepage')
-            child.text = md.url_homepage
-        for md in mds:
-            if md.priority:
-                component.set('priority', str(md.priority))
-
-        # add requires for each allowed vendor_ids
-        elements = {}
-        for md in mds:
-            if local:
-                break
-            vendor = db.session.query(Vendor).filter(Vendor.vendor_id == md.fw.vendor_id).first()
-            if not vendor:
-                continue
-            if not vendor.restrictions:
-                continue
+        vendor_ids = None
+        if not local:
+            vendor_ids = _get_component_vendor_ids(mds, vendor_restrictions)
+        fragments[appstream_id] = _get_metadata_fragment(mds, firmware_baseuri, local, vendor_ids)
+    return fragments
+
+def _indent_element(element, level):
+
+    # this matches libxml2, which does not format elements with mixed content
+    if not len(element):
+        return
+    if element.text and element.text.strip():
+        return
+    for child in element:
+        if child.tail and child.tail.strip():
+            return
+    indent = '\n' + '  ' * (level + 1)
+    element.text = indent
+    for child in element:
+        child.tail = indent
+        _indent_element(child, level + 1)
+    element[-1].tail = '\n' + '  ' * level
+
+def _write_metadata_fragments_tree(f, fragments):
+    root = ET.Element('components')
+    root.set('origin', 'lvfs')
+    root.set('version', '0.9')
+    for blob in fragments:
+        root.append(ET.fromstring(blob))
+    f.write(ET.tostring(root,
+                        encoding='UTF-8',
+                        xml_declaration=True,
+                        pretty_print=True))
+
+def _write_metadata_fragments_stream(f, fragments):
+
+    # only one component is parsed at any one time
+    f.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+    with ET.xmlfile(f, encoding='UTF-8') as xf:
+        with xf.element('components', origin='lvfs', version='0.9'):
+            for blob in fragments:
+                component = ET.fromstring(blob)
+                _indent_element(component, 1)
+                xf.write('\n  ', component)
+            xf.write('\n')
+    f.write(b'\n')
+
+class _HashingWriter:
+
+    """ Passes data through to other files, calculating the SHA256 hash """
+
+    def __init__(self, *fs):
+        self._fs = fs
+        self._csum = hashlib.sha256()
+
+    def write(self, data):
+        self._csum.update(data)
+        for f in self._fs:
+            f.write(data)
+        return len(data)
+
+    def hexdigest(self):
+        return self._csum.hexdigest()
+
+# the default for each extension, e.g. when writing local metadata
+_METADATA_COMPRESSION_LEVELS = {'gz': 5, 'xz': 6, 'zst': 19}
+
+class _UncompressedWriter:
+
+    """ Writes to another file object, which is closed by the caller """
+
+    def __init__(self, f):
+        self._f = f
+
+    def __enter__(self):
+        return self._f
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+def _get_metadata_compression():
+    """ Returns the compression level for each file extension to publish """
+    compression = {'gz': 5}
+    compression.update(app.config.get('METADATA_COMPRESSION', {}))
+    # the zstandard module is optional
+    if not zstandard:
+        compression.pop('zst', None)
+    return compression
+
+def _get_metadata_compressor(f, suffix, level):
+    """ Returns a file object that compresses into another """
+    if not suffix:
+        return _UncompressedWriter(f)
+    if suffix == 'gz':
+        # no timestamp or filename in the header so the output is reproducible
+        return gzip.GzipFile(filename='', fileobj=f, mode='wb', compresslevel=level, mtime=0)
+    if suffix == 'xz':
+        return lzma.LZMAFile(f, mode='wb', preset=level)
+    if suffix == 'zst' and zstandard:
+        return zstandard.ZstdCompressor(level=level).stream_writer(f)
+    raise NotImplementedError('compression %s not supported' % suffix)
+
+def _get_metadata_variant_filename(filename, suffix):
+    """ Returns the filename of the metadata with a different compression """
+    base, ext = os.path.splitext(filename)
+    if ext[1:] in _METADATA_COMPRESSION_LEVELS:
+        filename = base
+    if not suffix:
+        return filename
+    return filename + '.' + suffix
+
+def _get_metadata_variant_filenames(remote):
+    """ Returns the files for the currently published version of a remote """
+    download_dir = app.config['DOWNLOAD_DIR']
+    filenames = []
+    for suffix in _get_metadata_compression():
+        filenames.append(_get_metadata_variant_filename(os.path.join(download_dir, remote.filename),
+                                                        suffix))
+    return filenames
+
+def _get_metadata_is_published(filename, compression):
+    """ Returns True if every variant exists, and has been signed if any has """
+    signed = []
+    for suffix in compression:
+        fn = _get_metadata_variant_filename(filename, suffix)
+        try:
+            mtime = os.stat(fn).st_mtime_ns
+        except OSError as _:
+            return False
+
+        # a signature older than the file is for the previous version
+        try:
+            signed.append(os.stat(fn + '.asc').st_mtime_ns >= mtime)
+        except OSError as _:
+            signed.append(None)
+
+    # signing is optional, but all or nothing
+    return all(signed) or all(sig is None for sig in signed)
+
+def _write_metadata_fragments(filename, fragments, streaming=True, checksum=None, compression=None):
+    """ Writes compressed AppStream metadata, returning the SHA256 of the
+    uncompressed XML and the time taken
+
+    The XML is written once and compressed into a file for each extension in
+    compression, which defaults to just gzip. If the checksum is the same as
+    the one specified then the existing files are not replaced. This does not
+    use the database, and so can be run in a worker thread.
+    """
+    start = time.perf_counter()
+    if not compression:
+        compression = {'gz': 5}
+
+    filenames = [_get_metadata_variant_filename(filename, suffix) for suffix in compression]
+    with ExitStack() as stack:
+        compressors = []
+        for fn, suffix in zip(filenames, compression):
+            f = stack.enter_context(open(fn + '.tmp', 'wb'))
+            compressors.append(stack.enter_context(_get_metadata_compressor(f, suffix,
+                                                                            compression[suffix])))
+        writer = _HashingWriter(*compressors)
+        if streaming and fragments:
+            _write_metadata_fragments_stream(writer, fragments)
+        else:
+            _write_metadata_fragments_tree(writer, fragments)
+
+    # exactly the same as what is already published
+    for fn in filenames:
+        if checksum == writer.hexdigest() and os.path.exists(fn):
+            os.remove(fn + '.tmp')
+        else:
+            os.rename(fn + '.tmp', fn)
+    return writer.hexdigest(), time.perf_counter() - start
+
+def _write_metadata_delta(filename, checksum_old, checksum, index_old, fragments):
+    """ Writes the components that have changed since an older version """
+    root = ET.Element('delta')
+    root.set('origin', 'lvfs')
+    root.set('version', '0.9')
+    root.set('from', checksum_old)
+    root.set('to', checksum)
+    added = ET.Element('added')
+    changed = ET.Element('changed')
+    for appstream_id in fragments:
+        if appstream_id not in index_old:
+            added.append(ET.fromstring(fragments[appstream_id]))
+        elif index_old[appstream_id] != _get_fragment_checksum(fragments[appstream_id]):
+            changed.append(ET.fromstring(fragments[appstream_id]))
+    removed = ET.Element('removed')
+    for appstream_id in sorted(index_old):
+        if appstream_id not in fragments:
+            ET.SubElement(removed, 'id').text = appstream_id
+    for parent in [added, changed, removed]:
+        if len(parent):
+            root.append(parent)
+    with open(filename + '.tmp', 'wb') as f:
+        with gzip.GzipFile(filename='', fileobj=f, mode='wb', compresslevel=5, mtime=0) as gz:
+            gz.write(ET.tostring(root,
+                                 encoding='UTF-8',
+                                 xml_declaration=True,
+                                 pretty_print=True))
+    os.rename(filename + '.tmp', filename)
+
+def _get_fragment_checksum(blob):
+    return hashlib.sha256(blob).hexdigest()
+
+def _get_metadata_delta_filename(remote, checksum_old):
+    return '%s-delta-%s.xml.gz' % (remote.filename[:-7], checksum_old)
+
+def _get_metadata_delta_history_filename(remote):
+    return os.path.join(app.config['METADATA_DELTA_DIR'], remote.filename[:-7] + '.json')
+
+def _get_metadata_delta_history(remote):
+    """ Returns the recently published versions, oldest first """
+    if not app.config.get('METADATA_DELTA_DIR'):
+        return []
+    try:
+        with open(_get_metadata_delta_history_filename(remote), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as _:
+        return []
+
+def _get_metadata_delta_filenames(remote):
+    """ Returns the delta files for the currently published version """
+    download_dir = app.config['DOWNLOAD_DIR']
+    filenames = []
+    for version in _get_metadata_delta_history(remote)[:-1]:
+        filenames.append(os.path.join(download_dir,
+                                      _get_metadata_delta_filename(remote, version['checksum'])))
+    return filenames
+
+def _metadata_update_deltas(remote, fragments, checksum):
+    """ Writes a delta from each recently published version to the current one """
+    if not app.config.get('METADATA_DELTA_DIR'):
+        return
+    if not os.path.exists(app.config['METADATA_DELTA_DIR']):
+        os.makedirs(app.config['METADATA_DELTA_DIR'])
+    download_dir = app.config['DOWNLOAD_DIR']
 
-            # allow specifying more than one ID
-            vendor_ids = [res.value for res in vendor.restrictions]
-            child = ET.Element('firmware')
-            child.text = 'vendor-id'
-            if len(vendor_ids) == 1:
-                child.set('compare', 'eq')
-            else:
-                child.set('compare', 'regex')
-            child.set('version', '|'.join(vendor_ids))
-            elements['vendor-id'] = child
+    # clients that have anything older have to download the full file
+    versions = _get_metadata_delta_history(remote)
+    versions = [version for version in versions if version['checksum'] != checksum]
+    max_versions = app.config.get('METADATA_DELTA_VERSIONS', 5)
+    versions_keep = versions[-(max_versions - 1):] if max_versions > 1 else []
+    versions_expired = versions[:len(versions) - len(versions_keep)]
+    if versions_expired:
+        # the signatures of each delta are removed too
+        basenames = tuple([_get_metadata_delta_filename(remote, version['checksum'])
+                           for version in versions_expired])
+        for fn in os.listdir(download_dir):
+            if fn.startswith(basenames):
+                os.remove(os.path.join(download_dir, fn))
+
+    # write the deltas
+    index = {}
+    for appstream_id in fragments:
+        index[appstream_id] = _get_fragment_checksum(fragments[appstream_id])
+    for version in versions_keep:
+        _write_metadata_delta(os.path.join(download_dir,
+                                           _get_metadata_delta_filename(remote, version['checksum'])),
+                              version['checksum'], checksum,
+                              version['components'], fragments)
+
+    # save the index of this version for next time
+    versions_keep.append({'checksum': checksum, 'components': index})
+    fn = _get_metadata_delta_history_filename(remote)
+    with open(fn + '.tmp', 'w') as f:
+        json.dump(versions_keep, f)
+    os.rename(fn + '.tmp', fn)
+
+def _get_metadata_guid_index_filename(remote):
+    guid_dir = app.config.get('METADATA_GUID_DIR')
+    if not guid_dir:
+        return None
+    return os.path.join(guid_dir, remote.name + '.json')
+
+def _metadata_update_guid_index(remote, fragments, checksum):
+    """ Writes the components that provide each GUID for the query endpoint """
+    fn = _get_metadata_guid_index_filename(remote)
+    if not fn:
+        return
+    if not os.path.exists(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    components = {}
+    guids = defaultdict(list)
+    for appstream_id in fragments:
+        blob = fragments[appstream_id]
+        components[appstream_id] = blob.decode('utf-8')
+        for child in ET.fromstring(blob).xpath('provides/firmware[@type="flashed"]'):
+            guids[child.text.lower()].append(appstream_id)
+    with open(fn + '.tmp', 'w') as f:
+        json.dump({'checksum': checksum, 'components': components, 'guids': guids}, f)
+    os.rename(fn + '.tmp', fn)
+
+def _generate_metadata_kind(filename, fws, firmware_baseuri='', local=False, vendor_restrictions=None):
+    """ Generates AppStream metadata of a specific kind """
 
-        # add requires for <firmware> or fwupd version
-        for md in mds:
-            for rq in md.requirements:
-                if rq.kind == 'hardware':
-                    continue
-                child = ET.Element(rq.kind)
-                if rq.value:
-                    child.text = rq.value
-                if rq.compare:
-                    child.set('compare', rq.compare)
-                if rq.version:
-                    child.set('version', rq.version)
-                elements[rq.kind + str(rq.value)] = child
-
-        # add a single requirement for <hardware>
-        rq_hws = []
-        for md in mds:
-            for rq in md.requirements:
-                if rq.kind == 'hardware' and rq.value not in rq_hws:
-                    rq_hws.append(rq.value)
-        if rq_hws:
-            child = ET.Element('hardware')
-            child.text = '|'.join(rq_hws)
-            elements['hardware'] = child
-
-        # requires shared by all releases
-        if elements:
-            parent = ET.SubElement(component, 'requires')
-            for key in elements:
-                parent.append(elements[key])
-
-        # screenshot shared by all releases
-        elements = {}
-        for md in mds:
-            if not md.screenshot_url and not md.screenshot_caption:
-                continue
-            # try to dedupe using the URL and then the caption
-            key = md.screenshot_url
-            if not key:
-                key = md.screenshot_caption
-            if key not in elements:
-                child = ET.Element('screenshot')
-                if not elements:
-                    child.set('type', 'default')
-                if md.screenshot_caption:
-                    ET.SubElement(child, 'caption').text = md.screenshot_caption
-                if md.screenshot_url:
-                    ET.SubElement(child, 'image').text = md.screenshot_url
-                elements[key] = child
-        if elements:
-            parent = ET.SubElement(component, 'screenshots')
-            for key in elements:
-                parent.append(elements[key])
-
-        # add each release
-        releases = ET.SubElement(component, 'releases')
-        for md in mds:
-            if not md.version:
-                continue
-            rel = ET.SubElement(releases, 'release')
-            if md.release_timestamp:
-                rel.set('timestamp', str(md.release_timestamp))
-            if md.release_urgency and md.release_urgency != 'unknown':
-                rel.set('urgency', md.release_urgency)
-            if md.version:
-                rel.set('version', md.version)
-            ET.SubElement(rel, 'location').text = firmware_baseuri + md.fw.filename
-
-            # add container checksum
-            if md.fw.checksum_signed or local:
-                csum = ET.SubElement(rel, 'checksum')
-                #metadata intended to be used locally won't be signed
-                if local:
-                    csum.text = md.fw.checksum_upload
-                else:
-                    csum.text = md.fw.checksum_signed
-                csum.set('type', 'sha1')
-                csum.set('filename', md.fw.filename)
-                csum.set('target', 'container')
-
-            # add content checksum
-            if md.checksum_contents:
-                csum = ET.SubElement(rel, 'checksum')
-                csum.text = md.checksum_contents
-                csum.set('type', 'sha1')
-                csum.set('filename', md.filename_contents)
-                csum.set('target', 'content')
-
-            # add all device checksums
-            for csum in md.device_checksums:
-                n_csum = ET.SubElement(rel, 'checksum')
-                n_csum.text = csum.value
-                n_csum.set('type', csum.kind.lower())
-                n_csum.set('target', 'device')
-
-            # add long description
-            if md.release_description:
-                rel.append(_xml_from_markdown(md.release_description))
-
-            # add details URL if set
-            if md.details_url:
-                child = ET.SubElement(rel, 'url')
-                child.set('type', 'details')
-                child.text = md.details_url
-
-            # add source URL if set
-            if md.source_url:
-                child = ET.SubElement(rel, 'url')
-                child.set('type', 'source')
-                child.text = md.source_url
-
-            # add sizes if set
-            if md.release_installed_size:
-                sz = ET.SubElement(rel, 'size')
-                sz.set('type', 'installed')
-                sz.text = str(md.release_installed_size)
-            if md.release_download_size:
-                sz = ET.SubElement(rel, 'size')
-                sz.set('type', 'download')
-                sz.text = str(md.release_download_size)
-
-        # deliberately not including <category> here until 2020-01-01
-        if False:                       # pylint: disable=using-constant-test
-            cats = [] #lgtm [py/unreachable-statement]
-            for md in mds:
-                if not md.category:
-                    continue
-                if md.category.value not in cats:
-                    cats.append(md.category.value)
-                if md.category.fallbacks:
-                    for fallback in md.category.fallbacks.split(','):
-                        if fallback not in cats:
-                            cats.append(fallback)
-            if cats:
-                categories = ET.SubElement(root, 'categories')
-                for cat in cats:
-                    ET.SubElement(categories, 'category').text = cat
-
-        # provides shared by all releases
-        elements = {}
-        for md in mds:
-            for guid in md.guids:
-                if guid.value in elements:
-                    continue
-                child = ET.Element('firmware')
-                child.set('type', 'flashed')
-                child.text = guid.value
-                elements[guid.value] = child
-        if elements:
-            parent = ET.SubElement(component, 'provides')
-            for key in sorted(elements):
-                parent.append(elements[key])
-
-        # metadata shared by all releases
-        elements = {}
-        for md in mds:
-            if md.inhibit_download:
-                if 'LVFS::InhibitDownload' in elements:
-                    continue
-                child = ET.Element('value')
-                child.set('key', 'LVFS::InhibitDownload')
-                elements['LVFS::InhibitDownload'] = child
-            if md.version_format:
-                if 'LVFS::VersionFormat' in elements:
-                    continue
-                child = ET.Element('value')
-                child.set('key', 'LVFS::VersionFormat')
-                child.text = md.version_format
-                elements['LVFS::VersionFormat'] = child
-        if elements:
-            parent = ET.SubElement(component, 'custom')
-            for key in elements:
-                parent.append(elements[key])
-
-    # dump to file
-    et = ET.ElementTree(root)
-    et.write(filename,
-             encoding='utf-8',
-             xml_declaration=True,
-             compression=5,
-             pretty_print=True)
+    # this can be shared when generating more than one kind
+    if not local and vendor_restrictions is None:
+        vendor_restrictions = _get_vendor_restrictions()
+    fragments = _get_metadata_fragments(fws,
+                                        firmware_baseuri=firmware_baseuri,
+                                        local=local,
+                                        vendor_restrictions=vendor_restrictions)
+
+    # write exactly the file asked for, compressed if it has a known extension
+    suffix = os.path.splitext(filename)[1][1:]
+    if suffix not in _METADATA_COMPRESSION_LEVELS:
+        suffix = ''
+    _write_metadata_fragments(filename, list(fragments.values()),
+                              compression={suffix: _METADATA_COMPRESSION_LEVELS.get(suffix)})
 
 def _metadata_update_targets(remotes):
-    """ updates metadata for a specific target """
-    fws = db.session.query(Firmware).all()
+    """ updates metadata for a specific target, returning the new checksum of
+    each remote that changed, which should only be saved once it is signed, and
+    the total and writing time in seconds for every remote """
+    vendor_restrictions = _get_vendor_restrictions()
     settings = _get_settings()
 
     # set destination path from app config
@@ -269,24 +659,76 @@ def _metadata_update_targets(remotes):
     if not os.path.exists(download_dir):
         os.mkdir(download_dir)
 
-    # create metadata for each remote
+    # get the components for each remote, which needs the database
+    filenames = []
+    fragments = []
+    durations = []
     for r in remotes:
-        fws_filtered = []
-        for fw in fws:
-            if fw.is_deleted:
-                continue
-            if not fw.signed_timestamp:
-                continue
-            if r.check_fw(fw):
-                fws_filtered.append(fw)
-        _generate_metadata_kind(os.path.join(download_dir, r.filename),
-                                fws_filtered,
-                                firmware_baseuri=settings['firmware_baseuri'])
+        start = time.perf_counter()
+        fws_filtered = _get_firmware_for_export(r)
+        filenames.append(os.path.join(download_dir, r.filename))
+        fragments.append(_get_metadata_fragments(fws_filtered,
+                                                 firmware_baseuri=settings['firmware_baseuri'],
+                                                 vendor_restrictions=vendor_restrictions))
+        durations.append(time.perf_counter() - start)
 
         # all firmwares are contained in the correct metadata now
         for fw in fws_filtered:
             fw.is_dirty = False
 
+    # a newly enabled compression, or a lost signature, needs publishing even
+    # if nothing changed
+    compression = _get_metadata_compression()
+    checksums = []
+    for r, filename in zip(remotes, filenames):
+        if _get_metadata_is_published(filename, compression):
+            checksums.append(r.checksum_metadata)
+        else:
+            checksums.append(None)
+
+    # assemble and compress each remote in parallel; only the compression and
+    # the file writes run concurrently as zlib, lzma and zstandard release the
+    # GIL, and threads avoid forking with the database connections open
+    streaming = [True] * len(remotes)
+    compressions = [compression] * len(remotes)
+    workers = min(app.config.get('METADATA_WORKERS', os.cpu_count() or 1), len(remotes))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_write_metadata_fragments,
+                                        filenames,
+                                        [list(tmp.values()) for tmp in fragments],
+                                        streaming, checksums, compressions))
+    else:
+        results = list(map(_write_metadata_fragments,
+                           filenames,
+                           [list(tmp.values()) for tmp in fragments],
+                           streaming, checksums, compressions))
+
+    # only the remotes that have different content need signing
+    remotes_modified = {}
+    timings = {}
+    for r, duration, result, fragments_remote, checksum_old in zip(remotes, durations, results,
+                                                                   fragments, checksums):
+        checksum, duration_write = result
+
+        # clients can ask for just the components for their own hardware; the
+        # index is also written if it was only just enabled, or has been lost
+        if r.is_public:
+            fn = _get_metadata_guid_index_filename(r)
+            if fn and (checksum != checksum_old or not os.path.exists(fn)):
+                _metadata_update_guid_index(r, fragments_remote, checksum)
+        timings[r] = (duration + duration_write, duration_write)
+        if checksum == checksum_old:
+            continue
+        remotes_modified[r] = checksum
+
+        # clients with a recent version only need what has changed
+        _metadata_update_deltas(r, fragments_remote, checksum)
+
+    # remove any fragments not used for some time
+    _fragments.prune()
+    return remotes_modified, timings
+
 def _metadata_update_pulp():
 
     """ updates metadata for Pulp """
@@ -294,12 +736,12 @@ def _metadata_update_pulp():
     with open(os.path.join(download_dir, 'PULP_MANIFEST'), 'w') as manifest:
 
         # add metadata
-        for basename in ['firmware.xml.gz', 'firmware.xml.gz.asc']:
-            fn = os.path.join(download_dir, basename)
-            if os.path.exists(fn):
-                with open(fn, 'rb') as f:
-                    checksum_pulp = hashlib.sha256(f.read()).hexdigest()
-                manifest.write('%s,%s,%i\n' % (basename, checksum_pulp, os.path.getsize(fn)))
+        for suffix in _get_metadata_compression():
+            for basename in ['firmware.xml.' + suffix, 'firmware.xml.%s.asc' % suffix]:
+                fn = os.path.join(download_dir, basename)
+                checksum_pulp = csumcache.get(fn)
+                if checksum_pulp:
+                    manifest.write('%s,%s,%i\n' % (basename, checksum_pulp, os.path.getsize(fn)))
 
         # add firmware in stable
         for fw in db.session.query(Firmware).join(Remote).filter(Remote.is_public).all():
@@ -24,10 +24,11 @@ from flask import g, url_for
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from sqlalchemy import Column, Integer, Float, String, Text, Boolean, DateTime, ForeignKey, Index
+from sqlalchemy import or_
 from sqlalchemy.orm import relationship
 
-from lvfs import db
-from cabarchive import CabArchive
+from lvfs import db, fwresolver
+from cabarchive import CabArchive, CabReader, NotSupportedError
 from pkgversion import vercmp
 
 from .hash import _qa_hash, _password_hash, _otp_hash
@@ -1438,6 +1439,7 @@ class Remote(db.Model):
     name = Column(Text, nullable=False)
     is_public = Column(Boolean, default=False)
     is_dirty = Column(Boolean, default=False)
+    checksum_metadata = Column(String(64), default=None)  # SHA256 of the uncompressed XML
 
     # link using foreign keys
     vendors = relationship("Vendor", back_populates="remote")
@@ -1452,6 +1454,16 @@ class Remote(db.Model):
             return True
         return False
 
+    def check_fw_clause(self):
+        """ Returns an SQL expression that matches the same firmware as check_fw() """
+        if self.is_public:
+            return Firmware.remote_id == self.remote_id
+        user_ids = db.session.query(User.user_id).\
+                        join(Vendor, User.vendor_id == Vendor.vendor_id).\
+                        filter(Vendor.remote_id == self.remote_id)
+        return or_(Firmware.remote_id == self.remote_id,
+                   Firmware.user_id.in_(user_ids))
+
     @property
     def is_deleted(self):
         return self.name == 'deleted'
@@ -1544,6 +1556,13 @@ class FirmwareLimit(db.Model):
     # link back to parent
     fw = relationship("Firmware", back_populates="limits")
 
+def _set_md_blobs(mds, cabarchive):
+    for md in mds:
+        try:
+            md._blob = cabarchive[md.filename_contents].buf
+        except KeyError as _:
+            pass
+
 class Firmware(db.Model):
 
     # sqlalchemy metadata
@@ -1767,12 +1786,13 @@ class Firmware(db.Model):
 
     def _ensure_blobs(self):
         with open(_get_absolute_path(self), 'rb') as f:
-            cabarchive = CabArchive(f.read())
-        for md in self.mds:
+
+            # only the members we need are decompressed
             try:
-                md._blob = cabarchive[md.filename_contents].buf
-            except KeyError as _:
-                pass
+                _set_md_blobs(self.mds, CabReader(f))
+            except NotSupportedError as _:
+                f.seek(0)
+                _set_md_blobs(self.mds, CabArchive(f.read()))
 
     def _is_vendor(self, user):
         return self.vendor_id == user.vendor_id
@@ -1780,6 +1800,7 @@ class Firmware(db.Model):
     def mark_dirty(self):
         self.is_dirty = True
         self.remote.is_dirty = True
+        fwresolver.invalidate(self.filename)
 
     def check_acl(self, action, user=None):
 
@@ -1875,7 +1896,9 @@ class Client(db.Model):
 
     # sqlalchemy metadata
     __tablename__ = 'clients'
-    __table_args__ = {'mysql_character_set': 'utf8mb4'}
+    __table_args__ = (Index('idx_clients_firmware_id_timestamp', 'firmware_id', 'timestamp'),
+                      {'mysql_character_set': 'utf8mb4'}
+                     )
 
     id = Column(Integer, primary_key=True, nullable=False, unique=True)
     timestamp = Column(DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
@@ -2200,7 +2223,10 @@ class AnalyticFirmware(db.Model):
 
     # sqlalchemy metadata
     __tablename__ = 'analytics_firmware'
-    __table_args__ = {'mysql_character_set': 'utf8mb4'}
+    __table_args__ = (Index('idx_analytics_firmware_datestr_firmware_id', 'datestr', 'firmware_id',
+                            unique=True),
+                      {'mysql_character_set': 'utf8mb4'}
+                     )
 
     analytic_id = Column(Integer, primary_key=True, nullable=False, unique=True)
     datestr = Column(Integer, default=0, index=True)
@@ -2225,22 +2251,31 @@ class UseragentKind(Enum):
     LANG = 2
     DISTRO = 3
 
+def _get_useragent_value_hash(value):
+    """ The value can be too long to index, so the unique index uses a hash instead """
+    return hashlib.sha256((value or '').encode('utf-8')).hexdigest()
+
 class Useragent(db.Model):
 
     # sqlalchemy metadata
     __tablename__ = 'useragents'
-    __table_args__ = {'mysql_character_set': 'utf8mb4'}
+    __table_args__ = (Index('idx_useragents_datestr_kind_value_hash', 'datestr', 'kind', 'value_hash',
+                            unique=True),
+                      {'mysql_character_set': 'utf8mb4'}
+                     )
 
     useragent_id = Column(Integer, primary_key=True, nullable=False, unique=True)
     kind = Column(Integer, default=0, index=True)
     datestr = Column(Integer, default=0)
     value = Column(Text, default=None)
+    value_hash = Column(String(64), nullable=False)
     cnt = Column(Integer, default=1)
 
     def __init__(self, kind, value, datestr=0, cnt=1):
         """ Constructor for object """
         self.kind = kind.value
         self.value = value
+        self.value_hash = _get_useragent_value_hash(value)
         self.cnt = cnt
         self.datestr = datestr
 
@@ -9,6 +9,9 @@
 
 import os
 import sys
+import threading
+
+from contextlib import contextmanager
 
 from .util import _event_log, _get_settings
 
@@ -113,17 +116,83 @@ class PluginGeneral(PluginBase):
         s.append(PluginSettingInteger('default_failure_percentage', 'Report failures threshold for demotion', 70))
         return s
 
+class _PluginUnlimited:
+
+    """ Used for plugins that can be called from any number of threads """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class _PluginLock:
+
+    """ Limits how many threads can call into a plugin at the same time
+
+    A plugin often calls back into the plugin loader, e.g. to tell the other
+    plugins about the detached signature it just wrote, so a thread that
+    already holds the lock can enter it again.
+    """
+
+    def __init__(self, limit):
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._local = threading.local()
+
+    def __enter__(self):
+        depth = getattr(self._local, 'depth', 0)
+        if not depth:
+            self._semaphore.acquire()
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._local.depth -= 1
+        if not self._local.depth:
+            self._semaphore.release()
+        return False
+
+class _DeferredBatch:
+
+    """ The files collected for the deferred hooks, which can be shared by threads """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fns = []
+
+    def add(self, fns):
+        with self._lock:
+            self._fns.extend(fns)
+
+    def take(self):
+        with self._lock:
+            fns = self._fns
+            self._fns = []
+        return fns
+
 class Pluginloader:
 
-    def __init__(self, dirname='.'):
+    def __init__(self, dirname='.', concurrency=None):
         self._dirname = dirname
         self._plugins = []
+        self._concurrency = concurrency or {}
+        self._locks = {}
+        self._load_lock = threading.Lock()
+        self._deferred = threading.local()
         self.loaded = False
 
+    def _get_lock(self, plugin):
+        """ Limits how many threads can call into a plugin at the same time """
+        return self._locks.get(plugin.id, _PluginUnlimited())
+
     def load_plugins(self):
 
-        if self.loaded:
-            return
+        # the first call might be from several signing threads at once
+        with self._load_lock:
+            if not self.loaded:
+                self._load_plugins()
+
+    def _load_plugins(self):
 
         plugins = {}
         sys.path.insert(0, self._dirname)
@@ -164,6 +233,10 @@ class Pluginloader:
         # general item
         self._plugins.insert(0, PluginGeneral())
 
+        # e.g. a signing server that only accepts a few connections
+        for plugin_id in self._concurrency:
+            self._locks[plugin_id] = _PluginLock(self._concurrency[plugin_id])
+
         # success
         self.loaded = True
 
@@ -189,9 +262,75 @@ class Pluginloader:
                 if not plugin.enabled:
                     continue
                 try:
-                    plugin.file_modified(fn)
+                    with self._get_lock(plugin):
+                        plugin.file_modified(fn)
                 except PluginError as e:
                     _event_log('Plugin %s failed for FileModifed(%s): %s' % (plugin.id, fn, str(e)))
+        self._files_modified_deferred([fn])
+
+    # several files have been modified, which plugins can handle as a batch
+    def files_modified(self, fns):
+        if not self.loaded:
+            self.load_plugins()
+        for plugin in self._plugins:
+            if not hasattr(plugin, 'files_modified') and not hasattr(plugin, 'file_modified'):
+                continue
+            if not plugin.enabled:
+                continue
+            try:
+                with self._get_lock(plugin):
+                    if hasattr(plugin, 'files_modified'):
+                        plugin.files_modified(fns)
+                    else:
+                        for fn in fns:
+                            plugin.file_modified(fn)
+            except PluginError as e:
+                _event_log('Plugin %s failed for FilesModified(%s): %s' % (plugin.id, ','.join(fns), str(e)))
+        self._files_modified_deferred(fns)
+
+    # files are collected for the deferred hooks until the outermost block ends,
+    # e.g. so that a CDN can be purged once for a whole cron run; worker threads
+    # can add to the batch of another thread by passing the one it yielded
+    @contextmanager
+    def deferred(self, batch=None):
+        state = self._deferred
+        outermost = not getattr(state, 'depth', 0)
+        if outermost:
+            state.batch = batch or _DeferredBatch()
+            state.depth = 0
+        state.depth += 1
+        try:
+            yield state.batch
+        finally:
+            state.depth -= 1
+            if outermost:
+                fns = []
+                if not batch:
+                    fns = state.batch.take()
+                state.batch = None
+                if fns:
+                    self._files_modified_deferred_flush(fns)
+
+    def _files_modified_deferred(self, fns):
+        batch = getattr(self._deferred, 'batch', None)
+        if batch:
+            batch.add(fns)
+            return
+        self._files_modified_deferred_flush(fns)
+
+    def _files_modified_deferred_flush(self, fns):
+        if not self.loaded:
+            self.load_plugins()
+        fns = sorted(set(fns))
+        for plugin in self._plugins:
+            if hasattr(plugin, 'files_modified_deferred'):
+                if not plugin.enabled:
+                    continue
+                try:
+                    with self._get_lock(plugin):
+                        plugin.files_modified_deferred(fns)
+                except PluginError as e:
+                    _event_log('Plugin %s failed for FilesModifiedDeferred(%s): %s' % (plugin.id, ','.join(fns), str(e)))
 
     # an archive is being built
     def archive_sign(self, cabarchive, cabfile):
@@ -202,10 +341,30 @@ class Pluginloader:
                 if not plugin.enabled:
                     continue
                 try:
-                    plugin.archive_sign(cabarchive, cabfile)
+                    with self._get_lock(plugin):
+                        plugin.archive_sign(cabarchive, cabfile)
                 except PluginError as e:
                     _event_log('Plugin %s failed for ArchiveSign(): %s' % (plugin.id, str(e)))
 
+    # several files in an archive are being signed, which plugins can do as a batch
+    def archive_sign_many(self, cabarchive, cabfiles):
+        if not self.loaded:
+            self.load_plugins()
+        for plugin in self._plugins:
+            if not hasattr(plugin, 'archive_sign_many') and not hasattr(plugin, 'archive_sign'):
+                continue
+            if not plugin.enabled:
+                continue
+            try:
+                with self._get_lock(plugin):
+                    if hasattr(plugin, 'archive_sign_many'):
+                        plugin.archive_sign_many(cabarchive, cabfiles)
+                    else:
+                        for cabfile in cabfiles:
+                            plugin.archive_sign(cabarchive, cabfile)
+            except PluginError as e:
+                _event_log('Plugin %s failed for ArchiveSignMany(): %s' % (plugin.id, str(e)))
+
     # an archive is being built
     def archive_copy(self, cabarchive, cabfile):
         if not self.loaded:
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+
+from collections import namedtuple
+
+from sqlalchemy.orm import joinedload
+
+from .lrucache import LruCache
+
+FirmwareLimitInfo = namedtuple('FirmwareLimitInfo', ['value',
+                                                     'user_agent_glob',
+                                                     'response'])
+
+FirmwareDownloadInfo = namedtuple('FirmwareDownloadInfo', ['firmware_id',
+                                                           'checksum_pulp',
+                                                           'requires_fwupd',
+                                                           'banned_country_codes',
+                                                           'limits'])
+
+class FirmwareResolver:
+
+    """
+    Maps a cabinet archive basename to the small amount of data needed to
+    decide whether a download is allowed, so that the common case needs no
+    database queries at all.
+
+    Entries are dropped when the firmware is marked dirty, and also expire
+    after RESOLVER_CACHE_TIMEOUT seconds so that changes made in other
+    processes are picked up.
+    """
+
+    def __init__(self, app, db):
+        self._db = db
+        self._cache = LruCache(max_size=app.config.get('RESOLVER_CACHE_SIZE', 4096),
+                               max_age=app.config.get('RESOLVER_CACHE_TIMEOUT', 60))
+
+    def _load(self, basename):
+        from .models import Firmware, Requirement
+
+        fw = self._db.session.query(Firmware).\
+                    filter(Firmware.filename == basename).\
+                    options(joinedload('limits')).\
+                    options(joinedload('vendor')).first()
+        if not fw:
+            return None
+
+        # does any component require a specific fwupd version
+        requires_fwupd = False
+        component_ids = [md.component_id for md in fw.mds]
+        if component_ids:
+            req = self._db.session.query(Requirement.requirement_id).\
+                            filter(Requirement.component_id.in_(component_ids)).\
+                            filter(Requirement.kind == 'id').\
+                            filter(Requirement.value == 'org.freedesktop.fwupd').\
+                            first()
+            if req:
+                requires_fwupd = True
+
+        # this falls back to the vendor value
+        banned_country_codes = ()
+        if fw.banned_country_codes:
+            banned_country_codes = tuple(fw.banned_country_codes.split(','))
+
+        limits = []
+        for fl in fw.limits:
+            limits.append(FirmwareLimitInfo(fl.value, fl.user_agent_glob, fl.response))
+        return FirmwareDownloadInfo(fw.firmware_id,
+                                    fw.checksum_pulp,
+                                    requires_fwupd,
+                                    banned_country_codes,
+                                    tuple(limits))
+
+    def get(self, basename):
+        """ Returns a FirmwareDownloadInfo, or None if the file is unknown """
+        info = self._cache.get(basename)
+        if info:
+            return info
+        info = self._load(basename)
+        if info:
+            self._cache.set(basename, info)
+        return info
+
+    def invalidate(self, basename):
+        self._cache.pop(basename)
+
+    def clear(self):
+        self._cache.clear()
+
+    def __repr__(self):
+        return 'FirmwareResolver({})'.format(self._cache)
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position,too-few-public-methods
+
+import os
+import sys
+import hashlib
+import tempfile
+import unittest
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+
+from lvfs.checksumcache import ChecksumCache
+from lvfs.tests.fakeapp import FakeApp
+
+class CountingChecksumCache(ChecksumCache):
+
+    def __init__(self, app):
+        ChecksumCache.__init__(self, app, chunk_size=7)
+        self.hashed_cnt = 0
+
+    def _hash_file(self, path):
+        self.hashed_cnt += 1
+        return ChecksumCache._hash_file(self, path)
+
+class ChecksumCacheTest(unittest.TestCase):
+
+    def test_get(self):
+        with tempfile.TemporaryDirectory(prefix='lvfs') as tmpdir:
+            fn = os.path.join(tmpdir, 'firmware.cab')
+            with open(fn, 'wb') as f:
+                f.write(b'hello world' * 10)
+            csums = CountingChecksumCache(FakeApp())
+            self.assertEqual(csums.get(fn), hashlib.sha256(b'hello world' * 10).hexdigest())
+            self.assertEqual(csums.get(fn), hashlib.sha256(b'hello world' * 10).hexdigest())
+            self.assertEqual(csums.hashed_cnt, 1)
+
+            # the file changed size
+            with open(fn, 'wb') as f:
+                f.write(b'hello')
+            self.assertEqual(csums.get(fn), hashlib.sha256(b'hello').hexdigest())
+            self.assertEqual(csums.hashed_cnt, 2)
+
+            # does not exist
+            self.assertIsNone(csums.get(os.path.join(tmpdir, 'missing.cab')))
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory(prefix='lvfs') as tmpdir:
+            fn = os.path.join(tmpdir, 'firmware.cab')
+            with open(fn, 'wb') as f:
+                f.write(b'hello world')
+            app = FakeApp({'CHECKSUM_CACHE_FILE': os.path.join(tmpdir, 'checksums.json')})
+            csums = CountingChecksumCache(app)
+            csums.get(fn)
+            csums.save()
+
+            # a new process does not need to read the file again
+            csums = CountingChecksumCache(app)
+            self.assertEqual(csums.get(fn), hashlib.sha256(b'hello world').hexdigest())
+            self.assertEqual(csums.hashed_cnt, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import unittest
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+
+from lvfs.downloadcounter import DownloadWindow
+
+class DownloadWindowTest(unittest.TestCase):
+
+    def test_sliding(self):
+        window = DownloadWindow(minutes=10)
+        window.add(100)
+        window.add(100)
+        window.add(105)
+        self.assertEqual(window.count(105), 3)
+        self.assertEqual(window.count(109), 3)
+        self.assertEqual(window.count(110), 1)
+        self.assertEqual(window.count(115), 0)
+
+    def test_out_of_order(self):
+        window = DownloadWindow(minutes=10)
+        window.add(105)
+        window.add(101)
+        window.add(90)
+        self.assertEqual(window.count(105), 2)
+        self.assertEqual(window.count(111), 1)
+
+    def test_expire_all(self):
+        window = DownloadWindow(minutes=10)
+        window.add(100, cnt=5)
+        self.assertEqual(window.count(1000), 0)
+        window.add(1000)
+        self.assertEqual(window.count(1000), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,15 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=too-few-public-methods
+
+class FakeApp:
+
+    """ Just enough of the Flask app for the helpers that only read the config """
+
+    def __init__(self, config=None):
+        self.config = config or {}
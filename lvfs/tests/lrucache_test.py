@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import unittest
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+
+from lvfs.lrucache import LruCache
+
+class LruCacheTest(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = LruCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.hits, 3)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hit_rate, 0.75)
+
+    def test_invalidate(self):
+        cache = LruCache()
+        cache.set('a', 1)
+        cache.pop('a')
+        cache.pop('b')
+        self.assertNotIn('a', cache)
+        cache.set('b', 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_max_age(self):
+        cache = LruCache(max_age=-1)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertNotIn('a', cache)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,11 +13,15 @@ import sys
 import datetime
 import unittest
 import tempfile
+import shutil
 import subprocess
 import gzip
 import io
+import lzma
+import threading
 
 from contextlib import redirect_stdout
+from http.server import HTTPServer, BaseHTTPRequestHandler
 
 # allows us to run this from the project root
 sys.path.append(os.path.realpath('.'))
@@ -47,6 +51,9 @@ class LvfsTestCase(unittest.TestCase):
         self.db_fd, self.db_filename = tempfile.mkstemp()
         self.db_uri = 'sqlite:///' + self.db_filename
 
+        # everything written by the cron jobs
+        self.tmpdir = tempfile.mkdtemp()
+
         # write out custom settings file
         self.cfg_fd, self.cfg_filename = tempfile.mkstemp()
         with open(self.cfg_filename, 'w') as cfgfile:
@@ -61,6 +68,17 @@ class LvfsTestCase(unittest.TestCase):
                 "SECRET_ADDR_SALT = 'addr%%%'",
                 "SECRET_VENDOR_SALT = 'vendor%%%'",
                 "MAIL_SUPPRESS_SEND = True",
+                "CLIENT_QUEUE_SIZE = 1",
+                "CLIENT_QUEUE_TIMEOUT = 10",
+                "CLIENT_ARCHIVE_DIR = '%s'" % os.path.join(self.tmpdir, 'clients'),
+                "METADATA_FRAGMENT_DIR = '%s'" % os.path.join(self.tmpdir, 'fragments'),
+                "CHECKSUM_CACHE_FILE = '%s'" % os.path.join(self.tmpdir, 'checksums.json'),
+                "METADATA_COMPRESSION = {'gz': 5}",
+                "METADATA_DELTA_DIR = None",
+                "METADATA_GUID_DIR = None",
+                "SENDFILE_MODE = None",
+                "SIGNING_WORKERS = 4",
+                "CLIENT_RETENTION_DAYS = 180",
                 ]))
 
         # create instance
@@ -99,6 +117,7 @@ class LvfsTestCase(unittest.TestCase):
         os.unlink(self.db_filename)
         os.close(self.cfg_fd)
         os.unlink(self.cfg_filename)
+        shutil.rmtree(self.tmpdir)
 
     def _login(self, username, password='Pa$$w0rd'):
         return self.app.post('/lvfs/login', data=dict(
@@ -211,6 +230,68 @@ class LvfsTestCase(unittest.TestCase):
         assert 'DFU Version: 0x0100' in rv.data.decode('utf-8'), rv.data
         assert 'Found: DO NOT SHIP' in rv.data.decode('utf-8'), rv.data
 
+    def test_plugin_cdn_purge(self):
+
+        # a CDN that fails the first request
+        paths = []
+        class _PurgeHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                paths.append(self.path)
+                blob = b'{"status": "ok"}'
+                self.send_response(503 if len(paths) == 1 else 200)
+                self.send_header('Content-Length', str(len(blob)))
+                self.end_headers()
+                self.wfile.write(blob)
+            def log_message(self, *unused_args):
+                pass
+        server = HTTPServer(('127.0.0.1', 0), _PurgeHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        # enable the plugin
+        from lvfs import app, ploader
+        self.login()
+        rv = self.app.post('/lvfs/settings/modify/cdn-purge', data=dict(
+            cdn_purge_enable='enabled',
+            cdn_purge_uri='http://127.0.0.1:%i/purge?url=' % server.server_address[1],
+            cdn_purge_files='*.xml.gz\n*.xml.xz',
+            cdn_purge_method='GET',
+        ), follow_redirects=True)
+        assert b'Updated settings' in rv.data, rv.data
+        plugin = ploader.get_by_id('cdn-purge')
+        plugin._setting_kvs = {}
+
+        # nothing is purged until the end, and then each file only once
+        try:
+            with app.test_request_context():
+                with ploader.deferred() as batch:
+                    ploader.file_modified('/tmp/firmware.xml.gz')
+                    ploader.file_modified('/tmp/firmware.xml.gz')
+                    ploader.files_modified(['/tmp/firmware.xml.xz',
+                                            '/tmp/firmware-testing.xml.gz',
+                                            '/tmp/firmware.cab'])
+
+                    # a worker thread adds to the same batch
+                    def _worker():
+                        with app.test_request_context(), ploader.deferred(batch):
+                            ploader.file_modified('/tmp/firmware-embargo.xml.gz')
+                    worker = threading.Thread(target=_worker)
+                    worker.start()
+                    worker.join()
+                    assert not paths, paths
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            self.app.post('/lvfs/settings/modify/cdn-purge', data=dict(cdn_purge_enable='disabled'))
+            plugin._setting_kvs = {}
+        assert paths == ['/purge?url=firmware-embargo.xml.gz',
+                         '/purge?url=firmware-embargo.xml.gz',
+                         '/purge?url=firmware-testing.xml.gz',
+                         '/purge?url=firmware.xml.gz',
+                         '/purge?url=firmware.xml.xz'], paths
+
     def test_plugin_chipsec(self):
 
         self.login()
@@ -634,6 +715,227 @@ class LvfsTestCase(unittest.TestCase):
         rv = self.app.get('/lvfs/metadata')
         assert b'Remote will be signed with' not in rv.data, rv.data
 
+    def test_cron_metadata_fragments(self):
+
+        # upload file and generate the metadata
+        self.login()
+        self.upload('embargo')
+        self.run_cron_firmware()
+        self.run_cron_metadata(['embargo-admin'])
+        from lvfs import app, db
+        from lvfs.models import Remote
+        from lvfs.metadata import _fragments
+        with app.app_context():
+            remote = db.session.query(Remote).filter(Remote.name == 'embargo-admin').first()
+            filename = remote.filename
+        rv = self.app.get('/downloads/' + filename)
+        blob = rv.data
+        xml = _gzip_decompress_buffer(blob)
+        assert b'com.hughski.ColorHug2.firmware' in xml, xml
+
+        # regenerate when no firmware is dirty, which should reuse the fragment
+        rebuilt_cnt = _fragments.rebuilt_cnt
+        with app.app_context():
+            remote = db.session.query(Remote).filter(Remote.name == 'embargo-admin').first()
+            assert remote.checksum_metadata
+            remote.is_dirty = True
+            db.session.commit()
+        mtime = os.path.getmtime(os.path.join(app.config['DOWNLOAD_DIR'], filename))
+        self.run_cron_metadata(['embargo-admin'])
+        assert _fragments.rebuilt_cnt == rebuilt_cnt, _fragments
+
+        # the content is the same, so the file is not published again
+        assert os.path.getmtime(os.path.join(app.config['DOWNLOAD_DIR'], filename)) == mtime
+
+        # the compressed output is also identical
+        rv = self.app.get('/downloads/' + filename)
+        assert rv.data == blob
+
+        # a forced rebuild publishes the same content again
+        with app.app_context():
+            remote_id = db.session.query(Remote).filter(Remote.name == 'embargo-admin').first().remote_id
+        rv = self.app.get('/lvfs/metadata/rebuild/%i' % remote_id, follow_redirects=True)
+        assert b'marked as dirty' in rv.data, rv.data
+        with app.app_context():
+            assert not db.session.query(Remote).filter(Remote.remote_id == remote_id).first().checksum_metadata
+        self.run_cron_metadata(['embargo-admin'])
+        assert os.path.getmtime(os.path.join(app.config['DOWNLOAD_DIR'], filename)) != mtime
+        with app.app_context():
+            assert db.session.query(Remote).filter(Remote.remote_id == remote_id).first().checksum_metadata
+
+        # renaming the category does not mark the firmware dirty
+        from lvfs.models import Component, Category
+        for name in [None, 'Device Update']:
+            with app.app_context():
+                category = db.session.query(Category).filter(Category.value == 'X-Device').first()
+                category.name = name
+                db.session.query(Component).first().category_id = category.category_id
+                db.session.query(Remote).filter(Remote.name == 'embargo-admin').first().is_dirty = True
+                db.session.commit()
+            self.run_cron_metadata(['embargo-admin'])
+        xml = _gzip_decompress_buffer(self.app.get('/downloads/' + filename).data)
+        assert b'Device Update</name>' in xml, xml
+
+    def test_metadata_stream(self):
+
+        # upload two files and sign them
+        self.login()
+        self.upload('embargo')
+        self.upload('embargo', filename='contrib/blocklist.cab')
+        self.run_cron_firmware()
+
+        # the streaming writer is byte-for-byte the same as the tree writer
+        from lvfs import app, db
+        from lvfs.models import Remote
+        from lvfs.metadata import _get_firmware_for_export, _get_metadata_fragments
+        from lvfs.metadata import _write_metadata_fragments_tree, _write_metadata_fragments_stream
+        with app.app_context():
+            remote = db.session.query(Remote).filter(Remote.name == 'embargo-admin').first()
+            fragments = _get_metadata_fragments(_get_firmware_for_export(remote),
+                                                firmware_baseuri='https://fwupd.org/downloads/',
+                                                vendor_restrictions={})
+        assert len(fragments) == 2, fragments
+        with io.BytesIO() as f_tree, io.BytesIO() as f_stream:
+            _write_metadata_fragments_tree(f_tree, list(fragments.values()))
+            _write_metadata_fragments_stream(f_stream, list(fragments.values()))
+            assert b'<description>' in f_tree.getvalue(), f_tree.getvalue()
+            assert f_stream.getvalue() == f_tree.getvalue(), f_stream.getvalue()
+
+    def test_cron_metadata_compression(self):
+
+        # upload file and generate the metadata in each format
+        from lvfs import app
+        app.config['METADATA_COMPRESSION'] = {'gz': 5, 'xz': 6}
+        self.login()
+        self.upload(target='testing')
+        self.run_cron_firmware()
+        self.run_cron_metadata(['testing'])
+        rv = self.app.get('/downloads/firmware-testing.xml.gz')
+        xml = _gzip_decompress_buffer(rv.data)
+        assert b'com.hughski.ColorHug2.firmware' in xml, xml
+        rv = self.app.get('/downloads/firmware-testing.xml.xz')
+        assert rv.status_code == 200, rv.status_code
+        assert lzma.decompress(rv.data) == xml
+
+    def test_metadata_local(self):
+
+        # upload file
+        self.login()
+        self.upload()
+        from lvfs import app, db
+        from lvfs.models import Firmware
+        from lvfs.metadata import _generate_metadata_kind, _get_metadata_variant_filename
+        assert _get_metadata_variant_filename('/tmp/firmware.xml.gz', 'xz') == '/tmp/firmware.xml.xz'
+        assert _get_metadata_variant_filename('/tmp/firmware.xml', 'gz') == '/tmp/firmware.xml.gz'
+
+        # exactly the file asked for is written, compressed to match the extension
+        with app.app_context():
+            fws = db.session.query(Firmware).all()
+            for basename in ['out.xml', 'out.xml.xz']:
+                _generate_metadata_kind(os.path.join(self.tmpdir, basename), fws,
+                                        firmware_baseuri='firmware/', local=True)
+        assert not os.path.exists(os.path.join(self.tmpdir, 'out.xgz'))
+        with open(os.path.join(self.tmpdir, 'out.xml'), 'rb') as f:
+            xml = f.read()
+        assert b'com.hughski.ColorHug2.firmware' in xml, xml
+        with open(os.path.join(self.tmpdir, 'out.xml.xz'), 'rb') as f:
+            assert lzma.decompress(f.read()) == xml
+
+    def test_cron_metadata_delta(self):
+
+        from lvfs import app, db
+        from lvfs.models import Remote
+        app.config['METADATA_DELTA_DIR'] = os.path.join(self.tmpdir, 'deltas')
+
+        # publish the first version
+        self.login()
+        self.upload('embargo')
+        self.run_cron_firmware()
+        self.run_cron_metadata(['embargo-admin'])
+        with app.app_context():
+            remote = db.session.query(Remote).filter(Remote.name == 'embargo-admin').first()
+            checksum_old = remote.checksum_metadata
+            fn = remote.filename[:-7] + '-delta-' + checksum_old + '.xml.gz'
+
+        # add another device, and check the delta only includes that
+        self.upload('embargo', filename='contrib/blocklist.cab')
+        self.run_cron_firmware(fn='blocklist')
+        self.run_cron_metadata(['embargo-admin'])
+        rv = self.app.get('/downloads/' + fn)
+        assert rv.status_code == 200, rv.status_code
+        xml = _gzip_decompress_buffer(rv.data).decode('utf-8')
+        assert 'from="%s"' % checksum_old in xml, xml
+        assert 'com.acme.Dfu.firmware' in xml, xml
+        assert 'com.hughski.ColorHug2.firmware' not in xml, xml
+
+    def test_metadata_query(self):
+
+        from lvfs import app
+        app.config['METADATA_GUID_DIR'] = os.path.join(self.tmpdir, 'guids')
+
+        # publish to a public remote
+        self.login()
+        self.upload(target='testing')
+        self.run_cron_firmware()
+        self.run_cron_metadata(['testing'])
+
+        # only the matching component is returned
+        rv = self.app.get('/lvfs/metadata/query/testing?guid=2082B5E0-7A64-478A-B1B2-E3404FAB6DAD')
+        assert rv.status_code == 200, rv.status_code
+        assert b'com.hughski.ColorHug2.firmware' in rv.data, rv.data
+        rv = self.app.post('/lvfs/metadata/query/testing',
+                           data={'guid': ['00000000-0000-0000-0000-000000000000',
+                                          '2082b5e0-7a64-478a-b1b2-e3404fab6dad']})
+        assert b'com.hughski.ColorHug2.firmware' in rv.data, rv.data
+        rv = self.app.get('/lvfs/metadata/query/testing?guid=00000000-0000-0000-0000-000000000000')
+        assert rv.status_code == 200, rv.status_code
+        assert b'<component ' not in rv.data, rv.data
+
+        # invalid requests
+        rv = self.app.get('/lvfs/metadata/query/testing')
+        assert rv.status_code == 400, rv.status_code
+        rv = self.app.get('/lvfs/metadata/query/private?guid=2082b5e0-7a64-478a-b1b2-e3404fab6dad')
+        assert rv.status_code == 404, rv.status_code
+
+        # a lost index is written again even though the metadata is unchanged
+        os.remove(os.path.join(app.config['METADATA_GUID_DIR'], 'testing.json'))
+        self.run_cron_metadata(['testing'])
+        rv = self.app.get('/lvfs/metadata/query/testing?guid=2082b5e0-7a64-478a-b1b2-e3404fab6dad')
+        assert b'com.hughski.ColorHug2.firmware' in rv.data, rv.data
+
+    def _count_metadata_queries(self, remote_name):
+
+        from sqlalchemy import event
+        from lvfs import app, db
+        from lvfs.models import Remote
+        from lvfs.metadata import _metadata_update_targets, _fragments
+        statements = []
+        def _before_cursor_execute(unused_conn, unused_cursor, statement, *unused_args):
+            statements.append(statement)
+        _fragments.clear()
+        with app.test_request_context():
+            remote = db.session.query(Remote).filter(Remote.name == remote_name).first()
+            db.session.expire_all()
+            event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+            _metadata_update_targets([remote])
+            event.remove(db.engine, 'before_cursor_execute', _before_cursor_execute)
+            db.session.rollback()
+        return len(statements)
+
+    def test_cron_metadata_queries(self):
+
+        # one firmware
+        self.login()
+        self.upload('embargo')
+        self.run_cron_firmware()
+        cnt = self._count_metadata_queries('embargo-admin')
+
+        # adding more firmware should not add more queries
+        self.upload('embargo', filename='contrib/blocklist.cab')
+        self.upload('embargo', filename='contrib/intelme.cab')
+        self.run_cron_firmware(fn='blocklist')
+        assert self._count_metadata_queries('embargo-admin') == cnt
+
     def test_cron_firmware(self):
 
         # upload file, which will be unsigned
@@ -653,6 +955,32 @@ class LvfsTestCase(unittest.TestCase):
         rv = self.app.get('/lvfs/firmware/1/problems')
         assert b'Firmware is unsigned' not in rv.data, rv.data
 
+    def test_cron_firmware_failure(self):
+
+        # upload two files, and lose one of them
+        self.login()
+        self.upload('embargo')
+        self.upload('embargo', filename='contrib/blocklist.cab')
+        from lvfs import app, db
+        from lvfs.models import Firmware
+        from cron import _regenerate_and_sign_firmware
+        with app.app_context():
+            fw = db.session.query(Firmware).filter(Firmware.firmware_id == 2).first()
+            os.remove(os.path.join(app.config['DOWNLOAD_DIR'], fw.filename))
+
+        # the other firmware is still signed
+        app.config['SIGNING_WORKERS'] = 2
+        with app.test_request_context():
+            with io.StringIO() as buf, redirect_stdout(buf):
+                with self.assertRaises(NotImplementedError):
+                    _regenerate_and_sign_firmware()
+                stdout = buf.getvalue()
+        assert 'Failed to sign firmware 2' in stdout, stdout
+        rv = self.app.get('/lvfs/firmware/1')
+        assert b'Signed:' in rv.data, rv.data
+        rv = self.app.get('/lvfs/firmware/2')
+        assert b'Signed:' not in rv.data, rv.data
+
     def test_user_only_view_own_firmware(self):
 
         # create User:alice, User:bob, Analyst:clara, and QA:mario
@@ -1965,6 +2293,223 @@ ma+I7fM5pmgsEL4tkCZAg0+CPTyhHkMV/cWuOZUjqTsYbDq1pZI=
         for _ in range(5):
             self._download_firmware()
 
+    def test_download_queue(self):
+
+        # upload a file
+        self.login()
+        self.upload()
+
+        # buffer the downloads
+        from lvfs import app, db, clientq
+        from lvfs.models import Client, Firmware
+        app.config['CLIENT_QUEUE_SIZE'] = 3
+        flushed_cnt = clientq.flushed_cnt
+        for _ in range(2):
+            self._download_firmware()
+        with app.app_context():
+            assert db.session.query(Client).count() == 0
+            assert db.session.query(Firmware).first().download_cnt == 0
+
+        # hit the threshold
+        self._download_firmware()
+        with app.app_context():
+            assert db.session.query(Client).count() == 3
+            assert db.session.query(Firmware).first().download_cnt == 3
+        assert len(clientq) == 0, clientq
+        assert clientq.flushed_cnt == flushed_cnt + 3, clientq
+
+        # an old download is written at the end of any request
+        self._download_firmware()
+        with app.app_context():
+            assert db.session.query(Client).count() == 3
+        app.config['CLIENT_QUEUE_TIMEOUT'] = 0
+        rv = self.app.get('/lvfs/analytics/month')
+        assert b'Download Queue' in rv.data, rv.data
+        with app.app_context():
+            assert db.session.query(Client).count() == 4
+        assert len(clientq) == 0, clientq
+
+    def test_download_rollup(self):
+
+        # upload a file
+        self.login()
+        self.upload()
+        self.logout()
+
+        # the analytics are updated as the downloads are written
+        self._download_firmware(useragent='fwupd/1.2.3 (Linux x86_64 5.1.0; en_GB; Fedora 30)')
+        self._download_firmware(useragent='gnome-software/3.26.5 fwupd/1.2.3')
+        from lvfs import app, db
+        from lvfs.models import Analytic, AnalyticFirmware, Useragent, UseragentKind
+        with app.app_context():
+            assert db.session.query(Analytic).first().cnt == 2
+            assert db.session.query(AnalyticFirmware).first().cnt == 2
+            values = {}
+            for ug in db.session.query(Useragent).all():
+                values[(ug.kind, ug.value)] = ug.cnt
+        assert values[(UseragentKind.APP.value, 'fwupd/1.2.3')] == 1, values
+        assert values[(UseragentKind.APP.value, 'gnome-software/3.26.5')] == 1, values
+        assert values[(UseragentKind.FWUPD.value, '1.2.3')] == 2, values
+        assert values[(UseragentKind.LANG.value, 'en_GB')] == 1, values
+        assert values[(UseragentKind.DISTRO.value, 'Fedora 30')] == 1, values
+
+    def test_cron_archive_clients(self):
+
+        # upload a file and download it once
+        self.login()
+        self.upload()
+        self.logout()
+        self._download_firmware()
+
+        # add two downloads from before the retention period
+        from lvfs import app, db
+        from lvfs.models import Client, _get_datestr_from_datetime
+        from cron import _archive_clients
+        timestamp = datetime.datetime.utcnow() - datetime.timedelta(days=200)
+        datestr = _get_datestr_from_datetime(timestamp)
+        with app.app_context():
+            for addr in ['addr1', 'addr2']:
+                client = Client(addr=addr, firmware_id=1, user_agent='fwupd/1.2.3', timestamp=timestamp)
+                client.datestr = datestr
+                db.session.add(client)
+            db.session.commit()
+
+        # only the old downloads are moved to the archive
+        with app.test_request_context():
+            with io.StringIO() as buf, redirect_stdout(buf):
+                _archive_clients()
+                stdout = buf.getvalue()
+            assert 'archived 2 clients for %i' % datestr in stdout, stdout
+            assert db.session.query(Client).count() == 1
+        fn = os.path.join(app.config['CLIENT_ARCHIVE_DIR'], 'clients-%i.csv.gz' % datestr)
+        with gzip.open(fn, 'rt') as f:
+            lines = f.read().splitlines()
+        assert len(lines) == 3, lines
+        assert lines[0] == 'id,timestamp,addr,firmware_id,user_agent', lines
+        assert ',addr1,1,fwupd/1.2.3' in lines[1], lines
+
+        # nothing more to do
+        with app.test_request_context():
+            with io.StringIO() as buf, redirect_stdout(buf):
+                _archive_clients()
+                stdout = buf.getvalue()
+            assert 'archived' not in stdout, stdout
+
+        # a late download for the same day is added to the existing archive
+        with app.test_request_context():
+            client = Client(addr='addr3', firmware_id=1, user_agent='fwupd/1.2.3', timestamp=timestamp)
+            client.datestr = datestr
+            db.session.add(client)
+            db.session.commit()
+            with io.StringIO() as buf, redirect_stdout(buf):
+                _archive_clients()
+                stdout = buf.getvalue()
+            assert 'archived 1 clients for %i' % datestr in stdout, stdout
+        with gzip.open(fn, 'rt') as f:
+            lines = f.read().splitlines()
+        assert len(lines) == 4, lines
+        assert ',addr3,1,fwupd/1.2.3' in lines[3], lines
+
+    def test_download_resolver(self):
+
+        # upload a file and download it once to populate the cache
+        self.login()
+        self.upload()
+        self.logout()
+        self._download_firmware()
+
+        # the next download should not need the database
+        from sqlalchemy import event
+        from lvfs import app, db, clientq
+        statements = []
+        def _before_cursor_execute(unused_conn, unused_cursor, statement, *unused_args):
+            statements.append(statement)
+        app.config['CLIENT_QUEUE_SIZE'] = 100
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        self._download_firmware()
+        event.remove(engine, 'before_cursor_execute', _before_cursor_execute)
+        assert not statements, statements
+        with app.app_context():
+            assert clientq.flush() == 1
+
+    def test_download_sendfile(self):
+
+        # upload a file
+        self.login()
+        self.upload()
+
+        # let nginx send the file
+        from lvfs import app
+        fn = self.checksum_upload + '-hughski-colorhug2-2.0.3.cab'
+        app.config['SENDFILE_MODE'] = 'nginx'
+        rv = self.app.get('/downloads/' + fn)
+        assert rv.status_code == 200, rv.status_code
+        assert rv.headers['X-Accel-Redirect'] == '/internal/downloads/' + fn, rv.headers
+        assert not rv.data, rv.data
+
+        # let apache send the file
+        app.config['SENDFILE_MODE'] = 'apache'
+        rv = self.app.get('/downloads/' + fn)
+        assert rv.status_code == 200, rv.status_code
+        assert rv.headers['X-Sendfile'] == os.path.join(app.config['DOWNLOAD_DIR'], fn), rv.headers
+
+        # file does not exist
+        rv = self.app.get('/uploads/not-a-real-file.bin')
+        assert rv.status_code == 404, rv.status_code
+
+    def test_download_conditional(self):
+
+        # upload a file
+        self.login()
+        self.upload()
+        self.logout()
+
+        # download in full
+        from lvfs import app, db
+        from lvfs.models import Client
+        uri = '/downloads/' + self.checksum_upload + '-hughski-colorhug2-2.0.3.cab'
+        rv = self.app.get(uri)
+        assert rv.status_code == 200, rv.status_code
+        etag = rv.headers['ETag']
+        assert len(etag) == 66, etag
+
+        # the checksum is from the database, not by hashing the file again
+        from lvfs.models import Firmware
+        with app.app_context():
+            assert etag == '"%s"' % db.session.query(Firmware).first().checksum_pulp, etag
+
+        # the client already has the file
+        rv = self.app.get(uri, headers={'If-None-Match': etag})
+        assert rv.status_code == 304, rv.status_code
+        assert not rv.data, rv.data
+
+        # resume a partial download
+        rv = self.app.get(uri, headers={'Range': 'bytes=100-199'})
+        assert rv.status_code == 206, rv.status_code
+        assert len(rv.data) == 100, len(rv.data)
+
+        # only the first download was counted
+        with app.app_context():
+            assert db.session.query(Client).count() == 1
+
+    def test_geoip_lookup(self):
+
+        # only the first lookup uses the database
+        from lvfs import geolookup
+        lookup_cnt = geolookup.lookup_cnt
+        for _ in range(3):
+            assert geolookup.country_code_by_addr('192.0.2.123') is None
+        assert geolookup.lookup_cnt == lookup_cnt + 1, geolookup
+        assert geolookup.lookup_time_avg is not None, geolookup
+
+        # the timings are shown to admins
+        self.login()
+        rv = self.app.get('/lvfs/analytics/month')
+        assert b'Country Lookups' in rv.data, rv.data
+        assert b'Average' in rv.data, rv.data
+
     def test_download_old_fwupd(self):
 
         # upload a file
@@ -1983,6 +2528,13 @@ ma+I7fM5pmgsEL4tkCZAg0+CPTyhHkMV/cWuOZUjqTsYbDq1pZI=
         assert rv.status_code == 412, rv.status_code
         #assert b'fwupd version too old' in rv.data, rv.data
 
+        # a conditional request does not skip the check
+        uri = '/downloads/' + self.checksum_upload + '-hughski-colorhug2-2.0.3.cab'
+        etag = self.app.get(uri, environ_base={'HTTP_USER_AGENT': 'fwupd/1.0.5'}).headers['ETag']
+        rv = self.app.get(uri, headers={'If-None-Match': etag},
+                          environ_base={'HTTP_USER_AGENT': 'fwupd/0.7.9999'})
+        assert rv.status_code == 412, rv.status_code
+
     def test_agreement_upload_not_signed(self):
 
         # add a user and try to upload firmware without signing the agreement
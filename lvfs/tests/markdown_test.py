@@ -17,6 +17,7 @@ from lxml import etree as ET
 sys.path.append(os.path.realpath('.'))
 
 from lvfs.util import _markdown_from_root, _xml_from_markdown, _get_update_description_problems
+from lvfs.util import _markdown_cache
 
 class MarkdownTest(unittest.TestCase):
 
@@ -53,5 +54,19 @@ class MarkdownTest(unittest.TestCase):
         for problem in _get_update_description_problems(root):
             print(' * %s' % problem.description)
 
+    def test_cache(self):
+
+        # each call returns a new tree that can be modified
+        _markdown_cache.clear()
+        hits = _markdown_cache.hits
+        markdown = 'Fixes:\n * Do not crash when cached'
+        root1 = _xml_from_markdown(markdown)
+        root2 = _xml_from_markdown(markdown)
+        self.assertIsNot(root1, root2)
+        self.assertEqual(ET.tostring(root1), ET.tostring(root2))
+        self.assertEqual(_markdown_cache.hits, hits + 1)
+        root1.set('modified', 'true')
+        self.assertIsNone(_xml_from_markdown(markdown).get('modified'))
+
 if __name__ == '__main__':
     unittest.main()
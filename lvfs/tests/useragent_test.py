@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+#
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import unittest
+
+# allows us to run this from the project root
+sys.path.append(os.path.realpath('.'))
+
+from lvfs.useragent import UserAgentClassifier
+from lvfs.tests.fakeapp import FakeApp
+
+class UserAgentTest(unittest.TestCase):
+
+    def test_banned(self):
+        uac = UserAgentClassifier(FakeApp())
+        self.assertTrue(uac.classify('Mozilla/5.0 (compatible; MJ12BOT/v1.4.8)').is_banned)
+        self.assertTrue(uac.classify('Sogou web spider/4.0').is_banned)
+        self.assertFalse(uac.classify('fwupd/1.2.3').is_banned)
+        self.assertFalse(uac.classify(None).is_banned)
+        uac = UserAgentClassifier(FakeApp({'USER_AGENT_BANNED': ['evil']}))
+        self.assertTrue(uac.classify('evil/1.0').is_banned)
+        self.assertFalse(uac.classify('Sogou web spider/4.0').is_banned)
+
+    def test_requirement(self):
+        uac = UserAgentClassifier(FakeApp())
+        self.assertFalse(uac.classify('fwupdmgr').is_safe_for_requirement)
+        self.assertFalse(uac.classify('fwupd/0.7.9999').is_safe_for_requirement)
+        self.assertTrue(uac.classify('fwupd/1.1.1').is_safe_for_requirement)
+        self.assertFalse(uac.classify('gnome-software/3.20.0').is_safe_for_requirement)
+        self.assertTrue(uac.classify('gnome-software/3.26.5 (Linux x86_64 4.14.0) '
+                                     'fwupd/1.0.4').is_safe_for_requirement)
+        self.assertTrue(uac.classify('curl/7.61.0').is_safe_for_requirement)
+        self.assertTrue(uac.classify(None).is_safe_for_requirement)
+
+    def test_parse(self):
+        uac = UserAgentClassifier(FakeApp())
+        ua = uac.classify('gnome-software/3.26.5 (Linux x86_64 4.14.0) fwupd/1.0.4')
+        self.assertEqual(ua.app, 'gnome-software/3.26.5')
+        self.assertEqual(ua.fwupd_version, '1.0.4')
+        self.assertEqual(ua.gnome_software_version, '3.26.5')
+        self.assertIsNone(ua.lang)
+        ua = uac.classify('fwupd/1.2.3 (Linux x86_64 5.1.0; en_GB; Fedora 30)')
+        self.assertEqual(ua.app, 'fwupd/1.2.3')
+        self.assertEqual(ua.lang, 'en_GB')
+        self.assertEqual(ua.distro, 'Fedora 30')
+
+    def test_cache(self):
+        uac = UserAgentClassifier(FakeApp({'USER_AGENT_CACHE_SIZE': 2}))
+        ua = uac.classify('fwupd/1.2.3')
+        self.assertIs(uac.classify('fwupd/1.2.3'), ua)
+        uac.classify('fwupd/1.2.4')
+        uac.classify('fwupd/1.2.5')
+        self.assertIsNot(uac.classify('fwupd/1.2.3'), ua)
+
+if __name__ == '__main__':
+    unittest.main()
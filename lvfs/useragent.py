@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Richard Hughes <richard@hughsie.com>
+#
+# SPDX-License-Identifier: GPL-2.0+
+
+import re
+
+from collections import namedtuple
+
+from pkgversion import vercmp
+
+from .lrucache import LruCache
+
+UserAgentInfo = namedtuple('UserAgentInfo', ['is_banned',
+                                             'is_safe_for_requirement',
+                                             'app',
+                                             'fwupd_version',
+                                             'gnome_software_version',
+                                             'lang',
+                                             'distro'])
+
+def _user_agent_safe_for_requirement(user_agent, fwupd_version, gnome_software_version):
+
+    # very early versions of fwupd used 'fwupdmgr' as the user agent
+    if user_agent == 'fwupdmgr':
+        return False
+
+    # gnome-software/3.26.5 (Linux x86_64 4.14.0) fwupd/1.0.4
+    if fwupd_version:
+        return vercmp(fwupd_version, '0.8.0') >= 0
+
+    # this is a heuristic; the logic is that it's unlikely that a distro would
+    # ship a very new gnome-software and a very old fwupd
+    if gnome_software_version:
+        return vercmp(gnome_software_version, '3.26.0') >= 0
+
+    # is is probably okay
+    return True
+
+def _get_lang_distro_from_ua(user_agent):
+
+    # fwupd/1.2.3 (Linux x86_64 5.1.0; en_GB; Fedora 30)
+    start = user_agent.find('(')
+    end = user_agent.rfind(')')
+    if start == -1 or end == -1:
+        return None, None
+    parts = user_agent[start+1:end].split('; ')
+    if len(parts) != 3:
+        return None, None
+    return parts[1], parts[2]
+
+class UserAgentClassifier:
+
+    """
+    Classifies the User-Agent of a download request.
+
+    There are only a few thousand different user agents compared to millions
+    of downloads, so the results are cached using the raw string as the key.
+    """
+
+    def __init__(self, app):
+        banned = app.config.get('USER_AGENT_BANNED', ['MJ12BOT', 'ltx71', 'Sogou'])
+        self._banned = None
+        if banned:
+            self._banned = re.compile('|'.join([re.escape(tmp) for tmp in banned]))
+        self._cache = LruCache(max_size=app.config.get('USER_AGENT_CACHE_SIZE', 4096))
+
+    def _classify(self, user_agent):
+
+        # only the first version of each token is used
+        tokens = {}
+        for chunk in user_agent.split(' '):
+            toks = chunk.split('/')
+            if len(toks) == 2 and toks[0] not in tokens:
+                tokens[toks[0]] = toks[1]
+        fwupd_version = tokens.get('fwupd')
+        gnome_software_version = tokens.get('gnome-software')
+        is_banned = bool(self._banned and self._banned.search(user_agent))
+        lang, distro = _get_lang_distro_from_ua(user_agent)
+        return UserAgentInfo(is_banned,
+                             _user_agent_safe_for_requirement(user_agent,
+                                                              fwupd_version,
+                                                              gnome_software_version),
+                             user_agent.split(' ')[0],
+                             fwupd_version,
+                             gnome_software_version,
+                             lang,
+                             distro)
+
+    def classify(self, user_agent):
+        """ Returns a UserAgentInfo for the User-Agent header value """
+        if not user_agent:
+            return UserAgentInfo(False, True, None, None, None, None, None)
+        info = self._cache.get(user_agent)
+        if info:
+            return info
+        info = self._classify(user_agent)
+        self._cache.set(user_agent, info)
+        return info
+
+    def __repr__(self):
+        return 'UserAgentClassifier({})'.format(self._cache)
@@ -9,6 +9,7 @@
 
 import os
 import json
+import hashlib
 import calendar
 import datetime
 import string
@@ -21,6 +22,11 @@ from functools import wraps
 from lxml import etree as ET
 from flask import request, flash, render_template, g, Response
 
+from .lrucache import LruCache
+
+# the same descriptions are converted many times when generating metadata
+_markdown_cache = LruCache(max_size=4096)
+
 def _fix_component_name(name, developer_name=None):
     if not name:
         return None
@@ -112,6 +118,16 @@ def _xml_from_markdown(markdown):
     """ return a ElementTree for the markdown text """
     if not markdown:
         return None
+
+    # the caller may modify the tree, so always return a new copy
+    key = hashlib.sha256(markdown.encode('utf-8')).hexdigest()
+    blob = _markdown_cache.get(key)
+    if not blob:
+        blob = ET.tostring(_xml_from_markdown_uncached(markdown), encoding='utf-8')
+        _markdown_cache.set(key, blob)
+    return ET.fromstring(blob)
+
+def _xml_from_markdown_uncached(markdown):
     ul = None
     root = ET.Element('description')
     for line in markdown.split('\n'):
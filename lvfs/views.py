@@ -10,51 +10,88 @@
 import os
 import datetime
 import fnmatch
+import mimetypes
 import humanize
 import iso3166
 
 from flask import request, flash, url_for, redirect, render_template
 from flask import send_from_directory, abort, Response, g
 from flask_login import login_required, login_user, logout_user
-from sqlalchemy.orm import joinedload
 
-import GeoIP
-
-from lvfs import app, db, lm, ploader
-from pkgversion import vercmp
+from lvfs import app, db, lm, ploader, clientq, fwresolver, dlcounter, geolookup, uaclassifier
+from lvfs import csumcache
 
 from .dbutils import _execute_count_star
 from .pluginloader import PluginError
 
-from .models import Firmware, Requirement, Component, Vendor, Protocol, Category, Agreement
-from .models import User, Client, Event, AnalyticVendor
+from .models import Firmware, Component, Vendor, Protocol, Category, Agreement
+from .models import User, Event, AnalyticVendor
 from .models import _get_datestr_from_datetime
 from .hash import _addr_hash
 from .util import _get_client_address, _get_settings, _xml_from_markdown, _get_chart_labels_days
 from .util import _error_permission_denied, _event_log, _error_internal
 
-def _user_agent_safe_for_requirement(user_agent):
-
-    # very early versions of fwupd used 'fwupdmgr' as the user agent
-    if user_agent == 'fwupdmgr':
-        return False
-
-    # gnome-software/3.26.5 (Linux x86_64 4.14.0) fwupd/1.0.4
-    sections = user_agent.split(' ')
-    for chunk in sections:
-        toks = chunk.split('/')
-        if len(toks) == 2 and toks[0] == 'fwupd':
-            return vercmp(toks[1], '0.8.0') >= 0
-
-    # this is a heuristic; the logic is that it's unlikely that a distro would
-    # ship a very new gnome-software and a very old fwupd
-    for chunk in sections:
-        toks = chunk.split('/')
-        if len(toks) == 2 and toks[0] == 'gnome-software':
-            return vercmp(toks[1], '3.26.0') >= 0
-
-    # is is probably okay
-    return True
+def _response_not_modified(etag):
+    resp = Response(status=304)
+    resp.set_etag(etag)
+    return resp
+
+def _is_download_start():
+    """ Range requests that resume a partial download are not new downloads """
+    if not request.range:
+        return True
+    for start, _ in request.range.ranges:
+        if start == 0:
+            return True
+    return False
+
+def _send_from_directory(directory, location, filename, etag=None):
+    """ Send a file, optionally getting the front-end server to do the transfer """
+
+    # the client already has this exact file
+    if etag and etag in request.if_none_match:
+        return _response_not_modified(etag)
+
+    # stream the file using this worker, supporting Range requests
+    mode = app.config.get('SENDFILE_MODE')
+    if not mode:
+        if not etag:
+            return send_from_directory(directory, filename)
+        resp = send_from_directory(directory, filename, add_etags=False, conditional=False)
+        resp.set_etag(etag)
+        return resp.make_conditional(request,
+                                     accept_ranges=True,
+                                     complete_length=os.path.getsize(os.path.join(directory, filename)))
+
+    # only do the accounting here
+    path = os.path.join(directory, filename)
+    if not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0]
+    if not mimetype:
+        mimetype = 'application/octet-stream'
+    resp = Response(mimetype=mimetype)
+    if etag:
+        resp.set_etag(etag)
+    if mode == 'nginx':
+        prefix = app.config.get('SENDFILE_NGINX_PREFIX', '/internal/')
+        resp.headers['X-Accel-Redirect'] = prefix + location + '/' + filename
+    elif mode == 'apache':
+        resp.headers['X-Sendfile'] = path
+    else:
+        return _error_internal('Invalid SENDFILE_MODE %s' % mode)
+    return resp
+
+def _get_resource_etag(resource, info=None):
+    """ Uses the firmware checksum from the database, which cron updates when the
+    archive is re-signed, only hashing the file on disk for other resources """
+    if info and info.checksum_pulp:
+        return info.checksum_pulp
+    if resource.startswith('downloads/'):
+        return csumcache.get(os.path.join(app.config['DOWNLOAD_DIR'], os.path.basename(resource)))
+    if resource.startswith('deleted/'):
+        return csumcache.get(os.path.join(app.config['RESTORE_DIR'], os.path.basename(resource)))
+    return None
 
 @app.route('/<path:resource>')
 def serveStaticResource(resource):
@@ -62,55 +99,41 @@ def serveStaticResource(resource):
 
     # ban the robots that ignore robots.txt
     user_agent = request.headers.get('User-Agent')
-    if user_agent:
-        if user_agent.find('MJ12BOT') != -1:
-            abort(403)
-        if user_agent.find('ltx71') != -1:
-            abort(403)
-        if user_agent.find('Sogou') != -1:
-            abort(403)
+    ua = uaclassifier.classify(user_agent)
+    if ua.is_banned:
+        abort(403)
 
     # log certain kinds of files
     if resource.endswith('.cab'):
 
-        # increment the firmware download counter
-        fw = db.session.query(Firmware).\
-                filter(Firmware.filename == os.path.basename(resource)).\
-                options(joinedload('limits')).\
-                options(joinedload('vendor')).first()
-        if not fw:
+        # find the firmware, which is usually cached
+        info = fwresolver.get(os.path.basename(resource))
+        if not info:
             abort(404)
 
         # check the user agent isn't in the blocklist for this firmware
-        for md in fw.mds:
-            req = db.session.query(Requirement).\
-                            filter(Requirement.component_id == md.component_id).\
-                            filter(Requirement.kind == 'id').\
-                            filter(Requirement.value == 'org.freedesktop.fwupd').\
-                            first()
-            if req and user_agent and not _user_agent_safe_for_requirement(user_agent):
-                return Response(response='detected fwupd version too old',
-                                status=412,
-                                mimetype="text/plain")
+        if info.requires_fwupd and not ua.is_safe_for_requirement:
+            return Response(response='detected fwupd version too old',
+                            status=412,
+                            mimetype="text/plain")
 
         # check the firmware vendor has no country block
-        if fw.banned_country_codes:
-            banned_country_codes = fw.banned_country_codes.split(',')
-            geo = GeoIP.new(GeoIP.GEOIP_MEMORY_CACHE)
-            country_code = geo.country_code_by_addr(_get_client_address())
-            if country_code and country_code in banned_country_codes:
+        if info.banned_country_codes:
+            country_code = geolookup.country_code_by_addr(_get_client_address())
+            if country_code and country_code in info.banned_country_codes:
                 return Response(response='firmware not available from this IP range',
                                 status=451,
                                 mimetype="text/plain")
 
+        # the client already has this exact file, so this is not a download
+        etag = _get_resource_etag(resource, info)
+        if etag and etag in request.if_none_match:
+            return _response_not_modified(etag)
+
         # check any firmware download limits
-        for fl in fw.limits:
+        for fl in info.limits:
             if not fl.user_agent_glob or fnmatch.fnmatch(user_agent, fl.user_agent_glob):
-                datestr = _get_datestr_from_datetime(datetime.date.today() - datetime.timedelta(1))
-                cnt = _execute_count_star(db.session.query(Client).\
-                            filter(Client.firmware_id == fw.firmware_id).\
-                            filter(Client.datestr >= datestr))
-                if cnt >= fl.value:
+                if dlcounter.count(info.firmware_id) >= fl.value:
                     response = fl.response
                     if not response:
                         response = 'Too Many Requests'
@@ -120,22 +143,24 @@ def serveStaticResource(resource):
                     resp.headers['Retry-After'] = '86400'
                     return resp
 
-        # this is cached for easy access on the firmware details page
-        fw.download_cnt += 1
-
-        # log the client request
-        db.session.add(Client(addr=_addr_hash(_get_client_address()),
-                              firmware_id=fw.firmware_id,
-                              user_agent=user_agent))
-        db.session.commit()
+        # log the client request, which also increments the cached download
+        # counter shown on the firmware details page when the queue is flushed
+        if _is_download_start():
+            clientq.add(info.firmware_id, _addr_hash(_get_client_address()), user_agent)
+            if info.limits:
+                dlcounter.add(info.firmware_id)
+    else:
+        etag = _get_resource_etag(resource)
 
     # firmware blobs
     if resource.startswith('downloads/'):
-        return send_from_directory(app.config['DOWNLOAD_DIR'], os.path.basename(resource))
+        return _send_from_directory(app.config['DOWNLOAD_DIR'], 'downloads',
+                                    os.path.basename(resource), etag=etag)
     if resource.startswith('deleted/'):
-        return send_from_directory(app.config['RESTORE_DIR'], os.path.basename(resource))
+        return _send_from_directory(app.config['RESTORE_DIR'], 'deleted',
+                                    os.path.basename(resource), etag=etag)
     if resource.startswith('uploads/'):
-        return send_from_directory(app.config['UPLOAD_DIR'], os.path.basename(resource))
+        return _send_from_directory(app.config['UPLOAD_DIR'], 'uploads', os.path.basename(resource))
 
     # static files served locally
     return send_from_directory(os.path.join(app.root_path, 'static'), resource)
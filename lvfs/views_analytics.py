@@ -12,7 +12,7 @@ from sqlalchemy import and_
 from flask import render_template
 from flask_login import login_required
 
-from lvfs import app, db
+from lvfs import app, db, clientq, geolookup
 
 from .models import Analytic, Client, Report, Useragent, UseragentKind, SearchEvent, AnalyticVendor
 from .models import _get_datestr_from_datetime, _split_search_string
@@ -46,7 +46,9 @@ def analytics_month():
     return render_template('analytics-month.html',
                            category='analytics',
                            labels_days=_get_chart_labels_days()[::-1],
-                           data_days=data[::-1])
+                           data_days=data[::-1],
+                           clientq=clientq,
+                           geolookup=geolookup)
 
 @app.route('/lvfs/analytics/year')
 @login_required
@@ -14,7 +14,7 @@ from flask_login import login_required
 
 from sqlalchemy.orm import joinedload
 
-from lvfs import app, db
+from lvfs import app, db, fwresolver
 
 from .models import Firmware, Report, Client, FirmwareEvent, FirmwareLimit
 from .models import Remote, Vendor, AnalyticFirmware, Component
@@ -181,6 +181,7 @@ def firmware_nuke(firmware_id):
 
     # generate next cron run
     fw.remote.is_dirty = True
+    fwresolver.invalidate(fw.filename)
 
     # delete everything we stored about the firmware
     db.session.delete(fw)
@@ -432,6 +433,9 @@ def firmware_affiliation_change(firmware_id):
     fw.vendor_id = vendor_id
     db.session.commit()
 
+    # the banned country codes may be inherited from the new vendor
+    fwresolver.invalidate(fw.filename)
+
     # do we need to regenerate remotes?
     if fw.remote.name.startswith('embargo'):
         fw.vendor.remote.is_dirty = True
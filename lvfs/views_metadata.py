@@ -7,10 +7,10 @@
 
 import humanize
 
-from flask import render_template, make_response, flash, redirect, url_for
+from flask import render_template, make_response, flash, redirect, url_for, request, Response
 from flask_login import login_required
 
-from lvfs import app, db
+from lvfs import app, db, guidindex
 
 from .models import Vendor, Remote
 from .util import admin_login_required
@@ -80,11 +80,14 @@ def metadata_rebuild():
     scheduled_signing = None
     for r in db.session.query(Remote).filter(Remote.is_public).all():
         r.is_dirty = True
+        r.checksum_metadata = None
         if not scheduled_signing:
             scheduled_signing = r.scheduled_signing
     for vendor in db.session.query(Vendor).all():
         if vendor.is_account_holder:
             vendor.remote.is_dirty = True
+            vendor.remote.checksum_metadata = None
+    db.session.commit()
     if scheduled_signing:
         flash('Metadata will be rebuilt %s' % humanize.naturaltime(scheduled_signing), 'info')
     return redirect(url_for('.metadata_view'))
@@ -104,7 +107,39 @@ def metadata_rebuild_remote(remote_id):
         return redirect(url_for('.metadata_view'))
     r.is_dirty = True
 
+    # publish and sign again even if the content is the same
+    r.checksum_metadata = None
+
     # modify
     db.session.commit()
     flash('Remote %s marked as dirty' % r.name, 'info')
     return redirect(url_for('.metadata_view'))
+
+@app.route('/lvfs/metadata/query/<remote_name>', methods=['GET', 'POST'])
+def metadata_query(remote_name):
+    """
+    Returns just the components that provide any of the GUIDs.
+    """
+
+    # the GUID list can be too long for a GET on some systems
+    guids = request.args.getlist('guid') + request.form.getlist('guid')
+    if not guids:
+        return Response(response='no GUIDs specified',
+                        status=400,
+                        mimetype="text/plain")
+    if len(guids) > app.config.get('METADATA_GUID_QUERY_MAX', 1024):
+        return Response(response='too many GUIDs specified',
+                        status=400,
+                        mimetype="text/plain")
+
+    # only public remotes are indexed
+    if not remote_name.isalnum():
+        return Response(response='no remote with that name',
+                        status=404,
+                        mimetype="text/plain")
+    blob = guidindex.query(remote_name, guids)
+    if not blob:
+        return Response(response='no remote with that name',
+                        status=404,
+                        mimetype="text/plain")
+    return Response(response=blob, mimetype='application/xml')
@@ -15,7 +15,7 @@ from flask import request, flash, url_for, redirect, render_template, g
 from flask_login import login_required
 from sqlalchemy.orm import joinedload
 
-from lvfs import app, db
+from lvfs import app, db, fwresolver
 
 from .emails import send_email
 from .util import admin_login_required
@@ -613,6 +613,7 @@ def vendor_export_add(vendor_id):
     export_ids.append(export_id)
     vendor.banned_country_codes = ','.join(export_ids)
     db.session.commit()
+    fwresolver.clear()
     flash('Added blocked country %s' % export_id, 'info')
     return redirect(url_for('.vendor_exports', vendor_id=vendor_id), 302)
 
@@ -637,5 +638,6 @@ def vendor_export_delete(vendor_id, export_id):
     export_ids.remove(export_id)
     vendor.banned_country_codes = ','.join(export_ids)
     db.session.commit()
+    fwresolver.clear()
     flash('Deleted blocked country %s' % export_id, 'info')
     return redirect(url_for('.vendor_exports', vendor_id=vendor_id), 302)
@@ -0,0 +1,73 @@
+"""
+
+Revision ID: e4a7b1c2d3f5
+Revises: d1b89f7256f6
+Create Date: 2019-06-12 14:02:37.188312
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7b1c2d3f5'
+down_revision = 'd1b89f7256f6'
+
+from alembic import op
+import sqlalchemy as sa
+
+from lvfs.models import _get_useragent_value_hash
+
+_analytics_firmware = sa.table('analytics_firmware',
+                               sa.column('analytic_id', sa.Integer),
+                               sa.column('datestr', sa.Integer),
+                               sa.column('firmware_id', sa.Integer),
+                               sa.column('cnt', sa.Integer))
+
+_useragents = sa.table('useragents',
+                       sa.column('useragent_id', sa.Integer),
+                       sa.column('datestr', sa.Integer),
+                       sa.column('kind', sa.Integer),
+                       sa.column('value', sa.Text),
+                       sa.column('value_hash', sa.String(64)),
+                       sa.column('cnt', sa.Integer))
+
+def _merge_duplicates(bind, table, pkey, keys):
+    """ adds the cnt of each duplicate to the first row and deletes the others """
+    cols = [table.c[key] for key in keys]
+    stmt = sa.select([sa.func.min(table.c[pkey]), sa.func.sum(table.c.cnt)] + cols).\
+                group_by(*cols).\
+                having(sa.func.count() > 1)
+    cnt = 0
+    for row in bind.execute(stmt).fetchall():
+        matches = sa.and_(*[col == value for col, value in zip(cols, row[2:])])
+        bind.execute(table.update().where(table.c[pkey] == row[0]).values(cnt=row[1]))
+        bind.execute(table.delete().where(sa.and_(matches, table.c[pkey] != row[0])))
+        cnt += 1
+    if cnt:
+        print('merged %i duplicate %s rows' % (cnt, table.name))
+
+def upgrade():
+    bind = op.get_bind()
+
+    # the value is too long for a unique index
+    op.add_column('useragents', sa.Column('value_hash', sa.String(length=64), nullable=True))
+    for value, in bind.execute(sa.select([_useragents.c.value]).distinct()).fetchall():
+        if value is None:
+            matches = _useragents.c.value.is_(None)
+        else:
+            matches = _useragents.c.value == value
+        bind.execute(_useragents.update().where(matches).\
+                        values(value_hash=_get_useragent_value_hash(value)))
+    op.alter_column('useragents', 'value_hash', existing_type=sa.String(length=64), nullable=False)
+
+    # the old per-day stats could have been generated more than once
+    _merge_duplicates(bind, _analytics_firmware, 'analytic_id', ['datestr', 'firmware_id'])
+    _merge_duplicates(bind, _useragents, 'useragent_id', ['datestr', 'kind', 'value_hash'])
+
+    op.create_index('idx_clients_firmware_id_timestamp', 'clients', ['firmware_id', 'timestamp'], unique=False)
+    op.create_index('idx_analytics_firmware_datestr_firmware_id', 'analytics_firmware', ['datestr', 'firmware_id'], unique=True)
+    op.create_index('idx_useragents_datestr_kind_value_hash', 'useragents', ['datestr', 'kind', 'value_hash'], unique=True)
+
+def downgrade():
+    op.drop_index('idx_useragents_datestr_kind_value_hash', table_name='useragents')
+    op.drop_index('idx_analytics_firmware_datestr_firmware_id', table_name='analytics_firmware')
+    op.drop_index('idx_clients_firmware_id_timestamp', table_name='clients')
+    op.drop_column('useragents', 'value_hash')
@@ -0,0 +1,20 @@
+"""
+
+Revision ID: f2c8d9e1a0b4
+Revises: e4a7b1c2d3f5
+Create Date: 2019-06-14 09:47:12.508231
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8d9e1a0b4'
+down_revision = 'e4a7b1c2d3f5'
+
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('remotes', sa.Column('checksum_metadata', sa.String(length=64), nullable=True))
+
+def downgrade():
+    op.drop_column('remotes', 'checksum_metadata')
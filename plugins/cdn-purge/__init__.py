@@ -10,11 +10,16 @@
 import os
 import fnmatch
 import json
+import time
 import requests
 
 from lvfs.pluginloader import PluginBase, PluginError
 from lvfs.pluginloader import PluginSettingText, PluginSettingBool, PluginSettingTextList
 
+_PURGE_ATTEMPTS = 3
+_PURGE_RETRY_DELAY = 0.5    # seconds, doubled for each attempt
+_PURGE_TIMEOUT = 30         # seconds
+
 def _basename_matches_globs(basename, globs):
     for glob in globs:
         if fnmatch.fnmatch(basename, glob):
@@ -36,26 +41,29 @@ class Plugin(PluginBase):
         s.append(PluginSettingBool('cdn_purge_enable', 'Enabled', False))
         s.append(PluginSettingText('cdn_purge_uri', 'URI', 'https://bunnycdn.com/api/purge?url=https://lvfs.b-cdn.net/downloads/'))
         s.append(PluginSettingText('cdn_purge_accesskey', 'Accesskey', ''))
-        s.append(PluginSettingTextList('cdn_purge_files', 'File Whitelist', ['*.xml.gz', '*.xml.gz.asc']))
+        s.append(PluginSettingTextList('cdn_purge_files', 'File Whitelist', ['*.xml.gz', '*.xml.gz.asc', '*.xml.xz', '*.xml.xz.asc', '*.xml.zst', '*.xml.zst.asc']))
         s.append(PluginSettingText('cdn_purge_method', 'Request method', 'GET'))
         return s
 
-    def file_modified(self, fn):
+    def _purge(self, session, url, headers):
 
-        # is the file in the whitelist
-        fns = self.get_setting('cdn_purge_files', required=True)
-        basename = os.path.basename(fn)
-        if not _basename_matches_globs(basename, fns.split(',')):
-            print('%s not in %s' % (basename, fns))
-            return
+        # retry with backoff if the CDN is busy or cannot be reached
+        method = self.get_setting('cdn_purge_method', required=True)
+        for attempt in range(_PURGE_ATTEMPTS):
+            if attempt:
+                time.sleep(_PURGE_RETRY_DELAY * 2 ** (attempt - 1))
+            try:
+                r = session.request(method, url, headers=headers, timeout=_PURGE_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+                continue
+            if r.status_code == 429 or r.status_code >= 500:
+                error = 'HTTP status %i' % r.status_code
+                continue
+            break
+        else:
+            raise PluginError('Failed to purge metadata on CDN: %s' % error)
 
-        # purge
-        url = self.get_setting('cdn_purge_uri', required=True) + basename
-        headers = {}
-        accesskey = self.get_setting('cdn_purge_accesskey')
-        if accesskey:
-            headers['AccessKey'] = accesskey
-        r = requests.request(self.get_setting('cdn_purge_method', required=True), url, headers=headers)
         if r.text:
             try:
                 response = json.loads(r.text)
@@ -64,3 +72,33 @@ class Plugin(PluginBase):
             except ValueError as e:
                 # BunnyCDN doesn't sent a JSON blob
                 raise PluginError('Failed to purge metadata on CDN: %s: %s' % (r.text, str(e)))
+
+    def files_modified_deferred(self, fns):
+
+        # are the files in the whitelist
+        globs = self.get_setting('cdn_purge_files', required=True)
+        basenames = []
+        for fn in fns:
+            basename = os.path.basename(fn)
+            if not _basename_matches_globs(basename, globs.split(',')):
+                print('%s not in %s' % (basename, globs))
+                continue
+            if basename not in basenames:
+                basenames.append(basename)
+        if not basenames:
+            return
+
+        # purge, reusing the same connection
+        headers = {}
+        accesskey = self.get_setting('cdn_purge_accesskey')
+        if accesskey:
+            headers['AccessKey'] = accesskey
+        errors = []
+        with requests.Session() as session:
+            for basename in basenames:
+                try:
+                    self._purge(session, self.get_setting('cdn_purge_uri', required=True) + basename, headers)
+                except PluginError as e:
+                    errors.append(str(e))
+        if errors:
+            raise PluginError(', '.join(errors))
@@ -8,6 +8,7 @@
 # pylint: disable=no-self-use
 
 import os
+import threading
 import gnupg
 
 from cabarchive import CabFile
@@ -38,29 +39,40 @@ class Affidavit:
         if not self._keyid:
             raise PluginError('No imported private key for %s' % key_uid)
         self._homedir = homedir
+        self._gpg = gpg
 
     def create(self, data):
         """ Create detached signature data """
-        gpg = gnupg.GPG(gnupghome=self._homedir, gpgbinary='gpg2')
-        return gpg.sign(data, detach=True, keyid=self._keyid)
+        return self._gpg.sign(data, detach=True, keyid=self._keyid)
 
     def create_detached(self, filename):
-        """ Create a detached signature file """
+        """ Create a detached signature file, streaming the data to gpg """
         with open(filename, 'rb') as fin:
-            data = fin.read()
-            with open(filename + '.asc', 'wb') as f:
-                f.write(self.create(data))
+            blob_asc = self._gpg.sign_file(fin, detach=True, keyid=self._keyid)
+        if not blob_asc:
+            raise PluginError('Failed to sign %s: %s' % (filename, blob_asc.stderr))
+        with open(filename + '.asc', 'w') as f:
+            f.write(str(blob_asc))
         return filename + '.asc'
 
     def verify(self, data):
         """ Verify that the data was signed by something we trust """
-        gpg = gnupg.GPG(gnupghome=self._homedir, gpgbinary='gpg2')
-        gpg.encoding = 'utf-8'
-        ver = gpg.verify(data)
+        ver = self._gpg.verify(data)
         if not ver.valid:
             raise PluginError('Firmware was signed with an unknown private key')
         return True
 
+_affidavits = {}
+_affidavits_lock = threading.Lock()
+
+def _get_affidavit(key_uid, homedir):
+    """ Returns a signing context, only searching the keyring once per process """
+    with _affidavits_lock:
+        key = (homedir, key_uid)
+        if key not in _affidavits:
+            _affidavits[key] = Affidavit(key_uid, homedir)
+        return _affidavits[key]
+
 class Plugin(PluginBase):
     def __init__(self):
         PluginBase.__init__(self)
@@ -82,37 +94,36 @@ class Plugin(PluginBase):
                                    'sign-test@fwupd.org'))
         return s
 
-    def _metadata_modified(self, fn):
+    def files_modified(self, fns):
 
-        # generate
-        affidavit = Affidavit(self.get_setting('sign_gpg_metadata_uid', required=True),
-                              self.get_setting('sign_gpg_keyring_dir', required=True))
-        if not affidavit:
+        # generate, using the same context for every file
+        fns = [fn for fn in fns if fn.endswith(('.xml.gz', '.xml.xz', '.xml.zst'))]
+        if not fns:
             return
-        with open(fn, 'rb') as blob:
-            blob_asc = affidavit.create(blob.read())
-        fn_asc = fn + '.asc'
-        with open(fn_asc, 'w') as f:
-            f.write(str(blob_asc))
+        affidavit = _get_affidavit(self.get_setting('sign_gpg_metadata_uid', required=True),
+                                   self.get_setting('sign_gpg_keyring_dir', required=True))
+        fns_asc = [affidavit.create_detached(fn) for fn in fns]
 
         # inform the plugin loader
-        ploader.file_modified(fn_asc)
+        ploader.files_modified(fns_asc)
 
     def file_modified(self, fn):
-        if fn.endswith('.xml.gz'):
-            self._metadata_modified(fn)
+        self.files_modified([fn])
 
-    def archive_sign(self, cabarchive, cabfile):
+    def archive_sign_many(self, cabarchive, cabfiles):
 
         # already signed
-        detached_fn = cabfile.filename + '.asc'
-        if detached_fn in cabarchive:
+        cabfiles = [cabfile for cabfile in cabfiles
+                    if cabfile.filename + '.asc' not in cabarchive]
+        if not cabfiles:
             return
 
-        # create the detached signature
-        affidavit = Affidavit(self.get_setting('sign_gpg_firmware_uid', required=True),
-                              self.get_setting('sign_gpg_keyring_dir', required=True))
-        contents_asc = str(affidavit.create(cabfile.buf))
+        # create the detached signatures and add them to the archive
+        affidavit = _get_affidavit(self.get_setting('sign_gpg_firmware_uid', required=True),
+                                   self.get_setting('sign_gpg_keyring_dir', required=True))
+        for cabfile in cabfiles:
+            blob_asc = affidavit.create(cabfile.buf)
+            cabarchive[cabfile.filename + '.asc'] = CabFile(str(blob_asc).encode('utf-8'))
 
-        # add it to the archive
-        cabarchive[detached_fn] = CabFile(contents_asc.encode('utf-8'))
+    def archive_sign(self, cabarchive, cabfile):
+        self.archive_sign_many(cabarchive, [cabfile])
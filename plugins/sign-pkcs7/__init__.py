@@ -7,16 +7,85 @@
 #
 # pylint: disable=no-self-use
 
+import os
 import subprocess
 import tempfile
+import threading
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.serialization import pkcs7
+except ImportError as _:
+    pkcs7 = None
 
 from cabarchive import CabFile
 from lvfs.pluginloader import PluginBase, PluginError, PluginSettingText, PluginSettingBool
 from lvfs import ploader
 
+def _sign_blob_certtool(contents, privkey, certificate):
+    """ Signs using a new certtool process, used if cryptography is not installed """
+
+    # write firmware to temp file
+    src = tempfile.NamedTemporaryFile(mode='wb',
+                                      prefix='pkcs7_',
+                                      suffix=".bin",
+                                      dir=None,
+                                      delete=True)
+    src.write(contents)
+    src.flush()
+
+    # get p7b file from temp file
+    dst = tempfile.NamedTemporaryFile(mode='wb',
+                                      prefix='pkcs7_',
+                                      suffix=".p7b",
+                                      dir=None,
+                                      delete=True)
+
+    # sign
+    argv = ['certtool', '--p7-detached-sign', '--p7-time',
+            '--load-privkey', privkey,
+            '--load-certificate', certificate,
+            '--infile', src.name,
+            '--outfile', dst.name]
+    ps = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if ps.wait() != 0:
+        raise PluginError('Failed to sign: %s' % ps.stderr.read())
+
+    # read back the temp file
+    with open(dst.name, 'rb') as f:
+        return f.read().decode('utf-8')
+
+class Pkcs7Signer:
+
+    """ Creates detached signatures with a key and certificate loaded once """
+
+    def __init__(self, privkey, certificate):
+        try:
+            with open(privkey, 'rb') as f:
+                self._key = serialization.load_pem_private_key(f.read(),
+                                                               password=None,
+                                                               backend=default_backend())
+            with open(certificate, 'rb') as f:
+                self._certificate = x509.load_pem_x509_certificate(f.read(),
+                                                                   backend=default_backend())
+        except (OSError, ValueError) as e:
+            raise PluginError('Failed to load key: %s' % str(e))
+
+    def sign(self, contents):
+        """ Returns a PEM PKCS#7 signature, including the signing time """
+        builder = pkcs7.PKCS7SignatureBuilder().set_data(contents)
+        builder = builder.add_signer(self._certificate, self._key, hashes.SHA256())
+        blob = builder.sign(serialization.Encoding.PEM, [pkcs7.PKCS7Options.DetachedSignature])
+        return blob.decode('utf-8')
+
 class Plugin(PluginBase):
     def __init__(self):
         PluginBase.__init__(self)
+        self._signer = None
+        self._signer_key = None
+        self._signer_lock = threading.Lock()
 
     def name(self):
         return 'PKCS#7 Signing'
@@ -33,70 +102,66 @@ class Plugin(PluginBase):
                                    'pkcs7/fwupd.org_signed.pem'))
         return s
 
-    def _sign_blob(self, contents):
-
-        # write firmware to temp file
-        src = tempfile.NamedTemporaryFile(mode='wb',
-                                          prefix='pkcs7_',
-                                          suffix=".bin",
-                                          dir=None,
-                                          delete=True)
-        src.write(contents)
-        src.flush()
-
-        # get p7b file from temp file
-        dst = tempfile.NamedTemporaryFile(mode='wb',
-                                          prefix='pkcs7_',
-                                          suffix=".p7b",
-                                          dir=None,
-                                          delete=True)
-
-        # sign
-        argv = ['certtool', '--p7-detached-sign', '--p7-time',
-                '--load-privkey', self.get_setting('sign_pkcs7_privkey', required=True),
-                '--load-certificate', self.get_setting('sign_pkcs7_certificate', required=True),
-                '--infile', src.name,
-                '--outfile', dst.name]
-        ps = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if ps.wait() != 0:
-            raise PluginError('Failed to sign: %s' % ps.stderr.read())
-
-        # read back the temp file
-        with open(dst.name, 'rb') as f:
-            return f.read()
-
-    def _metadata_modified(self, fn):
-
-        # read in the file
-        with open(fn, 'rb') as fin:
-            blob = fin.read()
-        blob_p7b = self._sign_blob(blob)
-        if not blob_p7b:
+    def _get_signer(self, privkey, certificate):
+
+        # only load the key again if the files have changed
+        try:
+            key = (privkey, os.path.getmtime(privkey),
+                   certificate, os.path.getmtime(certificate))
+        except OSError as e:
+            raise PluginError('Failed to load key: %s' % str(e))
+        with self._signer_lock:
+            if key != self._signer_key:
+                self._signer = Pkcs7Signer(privkey, certificate)
+                self._signer_key = key
+            return self._signer
+
+    def sign_many(self, blobs):
+        """ Returns a detached signature for each blob """
+        privkey = self.get_setting('sign_pkcs7_privkey', required=True)
+        certificate = self.get_setting('sign_pkcs7_certificate', required=True)
+        if not pkcs7:
+            return [_sign_blob_certtool(blob, privkey, certificate) for blob in blobs]
+        signer = self._get_signer(privkey, certificate)
+        return [signer.sign(blob) for blob in blobs]
+
+    def files_modified(self, fns):
+
+        # read in the files
+        fns = [fn for fn in fns if fn.endswith(('.xml.gz', '.xml.xz', '.xml.zst'))]
+        if not fns:
             return
-
-        # write a new file
-        fn_p7b = fn + '.asc'
-        with open(fn_p7b, 'w') as f:
-            f.write(blob_p7b)
+        blobs = []
+        for fn in fns:
+            with open(fn, 'rb') as fin:
+                blobs.append(fin.read())
+
+        # write new files
+        fns_p7b = []
+        for fn, blob_p7b in zip(fns, self.sign_many(blobs)):
+            fn_p7b = fn + '.asc'
+            with open(fn_p7b, 'w') as f:
+                f.write(blob_p7b)
+            fns_p7b.append(fn_p7b)
 
         # inform the plugin loader
-        ploader.file_modified(fn_p7b)
+        ploader.files_modified(fns_p7b)
 
     def file_modified(self, fn):
-        if fn.endswith('.xml.gz'):
-            self._metadata_modified(fn)
+        self.files_modified([fn])
 
-    def archive_sign(self, cabarchive, cabfile):
+    def archive_sign_many(self, cabarchive, cabfiles):
 
         # already signed
-        detached_fn = cabfile.filename + '.p7b'
-        if detached_fn in cabarchive:
+        cabfiles = [cabfile for cabfile in cabfiles
+                    if cabfile.filename + '.p7b' not in cabarchive]
+        if not cabfiles:
             return
 
-        # create the detached signature
-        blob_p7b = self._sign_blob(cabfile.buf)
-        if not blob_p7b:
-            return
+        # create the detached signatures and add them to the archive
+        blobs_p7b = self.sign_many([cabfile.buf for cabfile in cabfiles])
+        for cabfile, blob_p7b in zip(cabfiles, blobs_p7b):
+            cabarchive[cabfile.filename + '.p7b'] = CabFile(blob_p7b.encode('utf-8'))
 
-        # add it to the archive
-        cabarchive[detached_fn] = CabFile(blob_p7b.encode('utf-8'))
+    def archive_sign(self, cabarchive, cabfile):
+        self.archive_sign_many(cabarchive, [cabfile])
@@ -83,7 +83,7 @@ class Plugin(PluginBase):
         ploader.file_modified(fn_asc)
 
     def file_modified(self, fn):
-        if fn.endswith('.xml.gz'):
+        if fn.endswith(('.xml.gz', '.xml.xz', '.xml.zst')):
             self._metadata_modified(fn)
 
     def archive_sign(self, cabarchive, cabfile):